@@ -0,0 +1,116 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+'''Аутентификация по токену без запроса к базе на каждый запрос.'''
+
+
+class TokenCache:
+    """Соответствие ключа токена и пары (id пользователя, is_active):
+    LRU в памяти процесса и общий кэш Django.
+
+    Сам пользователь не кэшируется, чтобы устаревшие значения его полей
+    не попадали в ответы и обратно в базу при save(). Записи в памяти
+    живут TOKEN_CACHE_LOCAL_TTL секунд, в общем кэше - TOKEN_CACHE_TTL
+    секунд. При выходе, смене пароля и деактивации пользователя записи
+    удаляются сигналами (см. api.signals); в других процессах копия в
+    памяти остается не дольше TOKEN_CACHE_LOCAL_TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get_shared_key(self, key):
+        return 'auth-token-user:' + hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.local_hits += 1
+                return entry[1]
+        user = cache.get(self.get_shared_key(key))
+        with self._lock:
+            if user is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+        self._store_local(key, user)
+        return user
+
+    def set(self, key, user):
+        cache.set(self.get_shared_key(key), user,
+                  getattr(settings, 'TOKEN_CACHE_TTL', 300))
+        self._store_local(key, user)
+
+    def _store_local(self, key, user):
+        expires = time.monotonic() + getattr(
+            settings, 'TOKEN_CACHE_LOCAL_TTL', 5)
+        with self._lock:
+            self._entries[key] = (expires, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > getattr(
+                    settings, 'TOKEN_CACHE_SIZE', 10000):
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys):
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        cache.delete_many([self.get_shared_key(key) for key in keys])
+
+    def stats(self):
+        with self._lock:
+            requests = self.local_hits + self.shared_hits + self.misses
+            return {
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (
+                    round((self.local_hits + self.shared_hits) / requests, 4)
+                    if requests else None),
+                'local_size': len(self._entries),
+            }
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, берущий id пользователя из token_cache.
+
+    При попадании в кэш каждый запрос получает новый экземпляр
+    пользователя, в котором загружены только id и is_active: остальные
+    поля читаются из базы при первом обращении, а save() без
+    update_fields записывает только загруженные поля.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, (user.pk, user.is_active))
+            return user, token
+        user_id, is_active = cached
+        if not is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        user_model = get_user_model()
+        user = user_model.from_db(
+            router.db_for_read(user_model), ('id', 'is_active'),
+            (user_id, is_active))
+        return user, self.get_model()(key=key, user=user)
@@ -0,0 +1,91 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.utils.http import urlencode
+
+'''Версии кэша по таблицам, кэширование количества строк выборки
+и ответов API.'''
+
+
+def get_version_key(table):
+    return f'table-version:{table}'
+
+
+def bump_table_version(table):
+    """Делает недействительными все записи кэша, зависящие от таблицы."""
+    key = get_version_key(table)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+
+
+def get_table_versions(tables):
+    keys = [get_version_key(table) for table in sorted(tables)]
+    versions = cache.get_many(keys)
+    return [versions.get(key, 1) for key in keys]
+
+
+def get_query_tables(queryset):
+    return {join.table_name for join in queryset.query.alias_map.values()}
+
+
+def get_estimated_count(queryset):
+    """Оценка числа строк из статистики планировщика PostgreSQL для
+    выборки без условий; None, если оценка неприменима."""
+    connection = connections[queryset.db]
+    query = queryset.query
+    if (connection.vendor != 'postgresql' or query.where
+            or query.distinct or len(query.alias_map) > 1):
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE relname = %s',
+            (queryset.model._meta.db_table,))
+        row = cursor.fetchone()
+    if row is None or row[0] < getattr(
+            settings, 'COUNT_ESTIMATE_THRESHOLD', 100000):
+        return None
+    return int(row[0])
+
+
+def get_cached_count(queryset):
+    """COUNT(*) выборки, закэшированный по тексту запроса и версиям всех
+    участвующих в нем таблиц на COUNT_CACHE_TTL секунд.
+
+    Ключ строится по запросу без сортировки и неиспользуемых в условиях
+    аннотаций (например, флагов is_favorited текущего пользователя),
+    поэтому одинаковые фильтры разных пользователей дают один ключ.
+    """
+    estimate = get_estimated_count(queryset)
+    if estimate is not None:
+        return estimate
+    count_queryset = queryset.order_by().values('pk')
+    try:
+        sql, params = count_queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    tables = get_query_tables(count_queryset)
+    signature = repr((sql, params, get_table_versions(tables)))
+    key = 'count:' + hashlib.sha256(signature.encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'COUNT_CACHE_TTL', 30))
+    return count
+
+
+def get_response_cache_key(request, tables):
+    """Ключ ответа: схема и хост (ответы содержат абсолютные ссылки),
+    путь, строка запроса без учета порядка параметров и версии таблиц,
+    из которых он собран."""
+    query = urlencode(sorted(
+        (name, sorted(values))
+        for name, values in request.query_params.lists()), doseq=True)
+    signature = repr((
+        request.scheme, request.get_host(), request.path, query,
+        get_table_versions(tables)))
+    return 'response:' + hashlib.sha256(signature.encode()).hexdigest()
@@ -0,0 +1,83 @@
+import gzip
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import Ingredient, Tag
+from .serializers import IngredientSerializer, TagSerializer
+
+'''Заранее собранные ответы для редко меняющихся справочников.'''
+
+
+class Catalog:
+    """Полный ответ списка справочника: JSON-тело, его gzip-версия
+    и строгий ETag, вычисленный по содержимому.
+
+    Сбрасывается сигналами при сохранении или удалении записей. Изменения
+    из других процессов подхватываются не позже чем через
+    CATALOG_CACHE_TTL секунд.
+    """
+
+    def __init__(self, queryset, serializer_class):
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self._lock = threading.Lock()
+        self._built = None
+        self._built_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._built = None
+
+    def get(self):
+        ttl = getattr(settings, 'CATALOG_CACHE_TTL', 300)
+        with self._lock:
+            if (self._built is None
+                    or time.monotonic() - self._built_at > ttl):
+                data = self.serializer_class(
+                    self.queryset.all(), many=True).data
+                body = JSONRenderer().render(data)
+                self._built = (
+                    body,
+                    gzip.compress(body, mtime=0),
+                    f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+                )
+                self._built_at = time.monotonic()
+            return self._built
+
+    def response(self, request):
+        body, gzipped, etag = self.get()
+        etags = get_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in etags or '*' in etags:
+            response = HttpResponseNotModified()
+        elif 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = HttpResponse(gzipped,
+                                    content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        response['Cache-Control'] = (
+            f'public, max-age={getattr(settings, "CATALOG_MAX_AGE", 60)}')
+        return response
+
+
+def get_etags(header):
+    """Разбирает If-None-Match; слабые ETag сравниваются как строгие,
+    потому что nginx ослабляет их при повторном сжатии."""
+    etags = set()
+    for etag in header.split(','):
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        etags.add(etag)
+    return etags
+
+
+ingredient_catalog = Catalog(Ingredient.objects.all(), IngredientSerializer)
+tag_catalog = Catalog(Tag.objects.all(), TagSerializer)
@@ -1,18 +1,11 @@
 import django_filters
+from django.db.models import F
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Recipe, Tag
+from recipes.search import search
 from users.models import User
 
 
-class IngredientFilter(django_filters.FilterSet):
-    name = django_filters.CharFilter(field_name='name',
-                                     lookup_expr='startswith')
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
-
-
 class RecipeFilter(django_filters.FilterSet):
     is_favorited = django_filters.NumberFilter(
         method='is_favorited_filter')
@@ -24,6 +17,10 @@ class RecipeFilter(django_filters.FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all())
+    search = django_filters.CharFilter(method='search_filter')
+    ordering = django_filters.ChoiceFilter(
+        choices=(('trending', 'trending'),),
+        method='ordering_filter')
 
     class Meta:
         model = Recipe
@@ -32,6 +29,8 @@ class RecipeFilter(django_filters.FilterSet):
             'author',
             'is_in_shopping_cart',
             'tags',
+            'search',
+            'ordering',
         )
 
     def is_favorited_filter(self, queryset, name, value):
@@ -45,3 +44,12 @@ class RecipeFilter(django_filters.FilterSet):
         if value and user.is_authenticated:
             return queryset.filter(shoppinglist__user=user)
         return queryset
+
+    def search_filter(self, queryset, name, value):
+        return search(queryset, value)
+
+    def ordering_filter(self, queryset, name, value):
+        """Популярные рецепты (по RecipeScore) первыми, остальные - по
+        дате публикации."""
+        return queryset.order_by(
+            F('score__score').desc(nulls_last=True), '-pub_date', '-id')
@@ -0,0 +1,178 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe, ShoppingList
+from users.models import Subscription
+
+'''Замер времени ответа и числа SQL-запросов основных эндпоинтов на
+данных, созданных командой seed, и сравнение с сохраненным эталоном.'''
+'''Запуск: "python manage.py benchmark [--requests 50] [--save-baseline]"'''
+'''Сохраненный в репозитории эталон (benchmarks/baseline.json) записан с
+--queries-only на данных "python manage.py seed" с параметрами по
+умолчанию: время ответа зависит от машины, число запросов - нет.'''
+
+DEFAULT_BASELINE = os.path.join(
+    settings.BASE_DIR, 'benchmarks', 'baseline.json')
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values, rank):
+    """Процентиль по методу ближайшего ранга; values отсортированы."""
+    index = max(0, -(-len(values) * rank // 100) - 1)
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = 'Measures endpoint latency and query counts against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Number of measured requests per endpoint')
+        parser.add_argument(
+            '--warmup', type=int, default=5,
+            help='Number of unmeasured requests per endpoint')
+        parser.add_argument(
+            '--baseline', default=DEFAULT_BASELINE,
+            help='Baseline JSON file to compare with or to write')
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Write the results to the baseline file')
+        parser.add_argument(
+            '--queries-only', action='store_true',
+            help='Save only query counts to the baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help='Allowed relative growth of the p95 latency')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['warmup'] < 0:
+            raise CommandError(
+                '--requests must be positive and --warmup not negative')
+        results = {}
+        for name, url in self.get_scenarios():
+            results[name] = self.measure(
+                url, options['requests'], options['warmup'])
+            self.stdout.write(f'{name:<40} {self.format(results[name])}')
+        report = {'database': connection.vendor, 'results': results}
+        if options['queries_only']:
+            report = {'results': {
+                name: {'queries': result['queries']}
+                for name, result in results.items()}}
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']) or '.',
+                        exist_ok=True)
+            with open(options['baseline'], 'w', encoding='utf8') as file:
+                json.dump(report, file, indent=2, sort_keys=True)
+                file.write('\n')
+            self.stdout.write(self.style.SUCCESS(
+                f'Baseline saved to {options["baseline"]}'))
+            return
+        if not os.path.exists(options['baseline']):
+            raise CommandError(
+                f'Baseline {options["baseline"]} does not exist, '
+                f'record it with --save-baseline')
+        self.compare(results, options['baseline'], options['tolerance'])
+
+    def get_scenarios(self):
+        """Эндпоинты и данные для них: пользователь с подписками и
+        списком покупок, самый популярный рецепт и частый префикс
+        названия ингредиента."""
+        viewer_id = Subscription.objects.filter(
+            user__in=ShoppingList.objects.values('user')).values(
+                'user').annotate(authors=Count('id')).order_by(
+                    '-authors', 'user').values_list(
+                        'user', flat=True).first()
+        recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        if viewer_id is None or recipe is None or ingredient is None:
+            raise CommandError(
+                'Not enough data, run "python manage.py seed" first')
+        token, _ = Token.objects.get_or_create(user_id=viewer_id)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return (
+            ('GET /api/recipes/', '/api/recipes/'),
+            ('GET /api/recipes/{id}/', f'/api/recipes/{recipe.pk}/'),
+            ('GET /api/users/subscriptions/', '/api/users/subscriptions/'),
+            ('GET /api/ingredients/?name=',
+             f'/api/ingredients/?name={ingredient.name[:3]}'),
+            ('GET /api/recipes/download_shopping_cart/',
+             '/api/recipes/download_shopping_cart/'),
+        )
+
+    def measure(self, url, requests, warmup):
+        timings = []
+        queries = []
+        for number in range(warmup + requests):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                response = self.client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f'{url} returned {response.status_code}')
+            if number >= warmup:
+                timings.append(elapsed * 1000)
+                queries.append(len(context.captured_queries))
+        timings.sort()
+        result = {
+            f'p{rank}_ms': round(percentile(timings, rank), 2)
+            for rank in PERCENTILES}
+        result['mean_ms'] = round(sum(timings) / len(timings), 2)
+        result['queries'] = max(queries)
+        return result
+
+    def format(self, result):
+        return ' '.join(
+            f'p{rank} {result[f"p{rank}_ms"]:>7.2f} ms'
+            for rank in PERCENTILES) + f'  queries {result["queries"]}'
+
+    def compare(self, results, path, tolerance):
+        """Число запросов не должно расти совсем, p95 - не больше чем
+        на tolerance. Время сравнивается, только если эталон записан с
+        ним и на той же СУБД."""
+        try:
+            with open(path, encoding='utf8') as file:
+                baseline = json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Cannot read baseline {path}: {error}')
+        compare_timings = baseline.get('database') == connection.vendor
+        if not compare_timings:
+            self.stdout.write(self.style.WARNING(
+                f'Baseline has no timings for {connection.vendor}, '
+                f'only query counts are compared'))
+        regressions = []
+        for name, result in results.items():
+            expected = baseline.get('results', {}).get(name)
+            if expected is None:
+                self.stdout.write(f'NEW  {name}')
+                continue
+            problems = []
+            if result['queries'] > expected['queries']:
+                problems.append(
+                    f'queries {expected["queries"]} -> {result["queries"]}')
+            if (compare_timings and 'p95_ms' in expected
+                    and result['p95_ms'] > expected['p95_ms'] * (
+                        1 + tolerance)):
+                problems.append(
+                    f'p95 {expected["p95_ms"]} -> {result["p95_ms"]} ms')
+            if problems:
+                regressions.append(name)
+                self.stdout.write(f'FAIL {name}: ' + ', '.join(problems))
+            else:
+                self.stdout.write(f'OK   {name}')
+        if regressions:
+            raise CommandError(
+                'Regressions against the baseline: ' + ', '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,13 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class IgnoreFormatContentNegotiation(DefaultContentNegotiation):
+    """Выбирает рендерер без учета параметра ?format=.
+
+    Используется в действиях, где ?format= задает формат выгружаемого
+    файла, а не формат ответа API.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        renderer = renderers[0]
+        return (renderer, renderer.media_type)
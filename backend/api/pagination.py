@@ -1,6 +1,156 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .caching import get_cached_count
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, берущий общее количество из кэша (см. get_cached_count).
+    Списки, уже находящиеся в памяти, считаются как обычно."""
+
+    @cached_property
+    def count(self):
+        if not isinstance(self.object_list, QuerySet):
+            return len(self.object_list)
+        return get_cached_count(self.object_list)
 
 
 class LimitPagesPagination(PageNumberPagination):
+    django_paginator_class = CachedCountPaginator
     page_size_query_param = 'limit'
     page_size = 6
+
+
+class KeysetPagination(BasePagination):
+    """Постраничный вывод по ключу сортировки без COUNT(*) и OFFSET.
+
+    Курсор хранит значения полей сортировки последнего элемента страницы,
+    следующая страница выбирается условием "строго после курсора", поэтому
+    новые записи не сдвигают уже просмотренные страницы. Поля сортировки
+    берутся из атрибута cursor_ordering представления; последнее поле
+    должно быть уникальным.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 6
+    ordering = ('-id',)
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        self.limit = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+        results = list(queryset[:self.limit + 1])
+        self.has_next = len(results) > self.limit
+        results = results[:self.limit]
+        self.next_position = None
+        if self.has_next:
+            self.next_position = [
+                getattr(results[-1], field.lstrip('-'))
+                for field in self.ordering]
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return page_size if page_size > 0 else self.page_size
+
+    def get_position_filter(self, position):
+        """Лексикографическое условие (a, b) < (x, y) с учетом
+        направления сортировки каждого поля."""
+        position_filter = Q()
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition = Q(**{f'{name}__{lookup}': position[index]})
+            for previous, value in zip(self.ordering[:index], position):
+                condition &= Q(**{previous.lstrip('-'): value})
+            position_filter |= condition
+        # Избыточная граница по первому полю позволяет базе начать
+        # просмотр индекса сразу с позиции курсора.
+        first = self.ordering[0]
+        bound = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{bound}': position[0]}) & (
+            position_filter)
+
+    def decode_cursor(self, request, model):
+        """Значения курсора, приведенные к типам полей сортировки."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(
+                encoded.encode('ascii')))
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list)
+                or len(position) != len(self.ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        position = [
+            value.isoformat() if isinstance(value, (date, datetime))
+            else value
+            for value in position]
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(position).encode('ascii')).decode('ascii')
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+
+class LimitPagesOrKeysetPagination(LimitPagesPagination):
+    """Номера страниц по умолчанию; если в запросе есть параметр ?cursor=
+    (для первой страницы - пустой), вывод идет по ключу."""
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_pagination_class.cursor_query_param in (
+                request.query_params):
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,109 @@
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from recipes.models import (Tag, Ingredient, Recipe, AmountOfIngredients,
+                            Favorite, ShoppingList, TimelineEntry,
+                            RecipeScore)
+from users.models import User, Subscription
+
+'''Сценарии запросов к основным эндпоинтам на данных заданного размера
+для проверки числа SQL-запросов и планов выполнения (api.tests).'''
+
+PREFIX = 'querybudget'
+
+
+class EndpointScenarios:
+    """Каждый сценарий создает данные размера size и возвращает клиент
+    и адрес запроса."""
+
+    def get_scenarios(self):
+        return (
+            ('GET /api/recipes/ (anonymous)', self.recipe_list_anonymous),
+            ('GET /api/recipes/{id}/ (anonymous)',
+             self.recipe_detail_anonymous),
+            ('GET /api/recipes/', self.recipe_list),
+            ('GET /api/recipes/{id}/', self.recipe_detail),
+            ('GET /api/users/', self.user_list),
+            ('GET /api/users/subscriptions/', self.subscriptions),
+            ('GET /api/recipes/feed/', self.feed),
+            ('GET /api/recipes/trending/', self.trending),
+        )
+
+    def create_fixture(self, authors_count, ingredients_per_recipe=2):
+        viewer = User.objects.create(
+            username=f'{PREFIX}-viewer', email=f'{PREFIX}-viewer@test.ru')
+        User.objects.bulk_create(
+            User(username=f'{PREFIX}-author-{i}',
+                 email=f'{PREFIX}-author-{i}@test.ru')
+            for i in range(authors_count))
+        Tag.objects.bulk_create(
+            Tag(name=f'{PREFIX}-{i}', color=f'#qb{i:04d}',
+                slug=f'{PREFIX}-{i}')
+            for i in range(2))
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'{PREFIX}-{i}', measurement_unit='г')
+            for i in range(ingredients_per_recipe))
+        tags = list(Tag.objects.filter(slug__startswith=PREFIX))
+        ingredients = list(Ingredient.objects.filter(
+            name__startswith=PREFIX))
+        for author in User.objects.filter(
+                username__startswith=f'{PREFIX}-author-'):
+            recipe = Recipe.objects.create(
+                author=author, name=f'{PREFIX}-{author.pk}',
+                text=PREFIX, cooking_time=1)
+            recipe.tags.set(tags)
+            AmountOfIngredients.objects.bulk_create(
+                AmountOfIngredients(recipe=recipe, ingredient=ingredient)
+                for ingredient in ingredients)
+            Subscription.objects.create(user=viewer, author=author)
+            Favorite.objects.create(user=viewer, recipe=recipe)
+            ShoppingList.objects.create(user=viewer, recipe=recipe)
+        return viewer
+
+    def recipe_list_anonymous(self, size):
+        self.create_fixture(size)
+        return APIClient(), f'/api/recipes/?limit={size}'
+
+    def recipe_detail_anonymous(self, size):
+        self.create_fixture(1, ingredients_per_recipe=size)
+        recipe = Recipe.objects.get(name__startswith=PREFIX)
+        return APIClient(), f'/api/recipes/{recipe.pk}/'
+
+    def recipe_list(self, size):
+        viewer = self.create_fixture(size)
+        return self.get_client(viewer), f'/api/recipes/?limit={size}'
+
+    def recipe_detail(self, size):
+        viewer = self.create_fixture(1, ingredients_per_recipe=size)
+        recipe = Recipe.objects.get(name__startswith=PREFIX)
+        return self.get_client(viewer), f'/api/recipes/{recipe.pk}/'
+
+    def user_list(self, size):
+        viewer = self.create_fixture(size)
+        return self.get_client(viewer), f'/api/users/?limit={size + 1}'
+
+    def subscriptions(self, size):
+        viewer = self.create_fixture(size)
+        return (self.get_client(viewer),
+                f'/api/users/subscriptions/?limit={size}')
+
+    def feed(self, size):
+        viewer = self.create_fixture(size)
+        TimelineEntry.objects.bulk_create(
+            TimelineEntry(user=viewer, recipe=recipe)
+            for recipe in Recipe.objects.filter(name__startswith=PREFIX))
+        return self.get_client(viewer), f'/api/recipes/feed/?limit={size}'
+
+    def trending(self, size):
+        viewer = self.create_fixture(size)
+        RecipeScore.objects.bulk_create(
+            RecipeScore(recipe=recipe, score=recipe.pk,
+                        computed_at=timezone.now())
+            for recipe in Recipe.objects.filter(name__startswith=PREFIX))
+        return (self.get_client(viewer),
+                f'/api/recipes/trending/?limit={size}')
+
+    def get_client(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
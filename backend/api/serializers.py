@@ -1,16 +1,61 @@
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.password_validation import validate_password
-from django.shortcuts import get_object_or_404
+from django.core.files.storage import default_storage
+from django.db import transaction
 from djoser.serializers import UserSerializer, UserCreateSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import NotFound
 
+from recipes.images import (VARIANT_FORMATS, VARIANT_SIZES,
+                            schedule_variants)
+from recipes.indexes import recipe_index
 from recipes.models import (Tag, Ingredient, Recipe,
                             AmountOfIngredients, Favorite,
-                            ShoppingList,
+                            ShoppingList, ShoppingCartTotal,
                             MIN_UNIT_AMOUNT, MAX_UNIT_AMOUNT)
 from users.models import User
 
+# Наибольшее число рецептов в одном запросе массовых операций.
+MAX_BULK_RECIPES = 100
+
+
+def get_selected_fields(request, field_names):
+    """Имена полей, оставшиеся после параметров ?fields= и ?omit=."""
+    selected = set(field_names)
+    requested = request.query_params.get('fields')
+    if requested:
+        selected &= {name.strip() for name in requested.split(',')}
+    omitted = request.query_params.get('omit')
+    if omitted:
+        selected -= {name.strip() for name in omitted.split(',')}
+    return selected
+
+
+class SparseFieldsMixin:
+    """Оставляет в ответе только поля из ?fields= и убирает поля из ?omit=.
+
+    Действует только на сериализатор верхнего уровня (или на элементы
+    списка верхнего уровня), вложенные сериализаторы не затрагивает.
+    Исключенные поля не вычисляются.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        parent = self.parent
+        if parent is not None and not (
+                isinstance(parent, serializers.ListSerializer)
+                and parent.parent is None):
+            return fields
+        request = self.context.get('request')
+        if request is None:
+            return fields
+        selected = get_selected_fields(request, fields)
+        return {
+            name: field for name, field in fields.items()
+            if name in selected}
+
 
 class CreateUserSerializer(UserCreateSerializer):
 
@@ -35,7 +80,8 @@ class CreateUserSerializer(UserCreateSerializer):
     def validate(self, data):
         email = data.get('email')
         username = data.get('username')
-        user_email_exists = User.objects.filter(email=email).exists()
+        user_email_exists = User.objects.filter(
+            email__iexact=email).exists()
         user_username_exists = User.objects.filter(username=username).exists()
         if (user_email_exists
                 and not user_username_exists):
@@ -52,7 +98,28 @@ class CreateUserSerializer(UserCreateSerializer):
         return password
 
 
-class UserReadOnlySerializer(UserSerializer):
+class SubscribedMixin:
+    """Вычисляет is_subscribed по множеству авторов, на которых подписан
+    текущий пользователь. Множество загружается одним запросом и хранится
+    в общем контексте, поэтому доступно и вложенным сериализаторам."""
+
+    def get_subscribed_authors(self):
+        subscribed = self.context.get('subscribed_authors')
+        if subscribed is None:
+            user = self.context.get('request').user
+            subscribed = set()
+            if user.is_authenticated:
+                subscribed = set(user.subscriber.values_list(
+                    'author_id', flat=True))
+            self.context['subscribed_authors'] = subscribed
+        return subscribed
+
+    def get_is_subscribed(self, obj):
+        return obj.pk in self.get_subscribed_authors()
+
+
+class UserReadOnlySerializer(SparseFieldsMixin, SubscribedMixin,
+                             UserSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -66,12 +133,6 @@ class UserReadOnlySerializer(UserSerializer):
             'is_subscribed',
         )
 
-    def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (
-            user.is_authenticated
-            and user.subscriber.filter(author=obj).exists())
-
 
 class SetPasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(required=True, max_length=150)
@@ -92,7 +153,10 @@ class SetPasswordSerializer(serializers.Serializer):
                 {'new_password': 'Новый пароль должен отличаться от текущего.'}
             )
         instance.set_password(validated_data['new_password'])
-        instance.save()
+        instance.save(update_fields=('password',))
+        # Токены, выданные со старым паролем, отзываются; их записи в
+        # кэше токенов удаляет сигнал post_delete.
+        Token.objects.filter(user=instance).delete()
         return validated_data
 
 
@@ -110,6 +174,11 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class IngredientSearchSerializer(serializers.Serializer):
+    name = serializers.CharField(required=False, max_length=200)
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+
 class IngredientsCreateOrUpdateSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField()
 
@@ -137,6 +206,30 @@ class IngredientsReadOnlySerializer(serializers.ModelSerializer):
         )
 
 
+class ImageVariantsMixin:
+    """Ссылки на уменьшенные копии фото; пока копии не готовы,
+    вместо каждой из них отдается исходное изображение."""
+
+    def get_image_variants(self, recipe):
+        request = self.context.get('request')
+
+        def build_url(name):
+            url = default_storage.url(name)
+            if request is not None:
+                return request.build_absolute_uri(url)
+            return url
+
+        original = build_url(recipe.image.name) if recipe.image else None
+        return {
+            variant: {
+                extension: (
+                    build_url(recipe.image_variants[variant][extension])
+                    if extension in recipe.image_variants.get(variant, {})
+                    else original)
+                for extension in VARIANT_FORMATS}
+            for variant in VARIANT_SIZES}
+
+
 class RecipeCreateOrUpdateSerializer(serializers.ModelSerializer):
     author = UserReadOnlySerializer(read_only=True,
                                     default=serializers.CurrentUserDefault())
@@ -175,14 +268,15 @@ class RecipeCreateOrUpdateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Рецепт должен содержать минимум 1 ингредиент!'
             )
-        ingredient_list = set()
-        for ingredient in ingredients:
-            ingredient = get_object_or_404(Ingredient, id=ingredient['id'])
-            if ingredient in ingredient_list:
-                raise serializers.ValidationError(
-                    'У рецепта не может быть два одинаковых ингредиента!'
-                )
-            ingredient_list.add(ingredient)
+        ingredient_ids = [ingredient['id'] for ingredient in ingredients]
+        if len(set(ingredient_ids)) != len(ingredient_ids):
+            raise serializers.ValidationError(
+                'У рецепта не может быть два одинаковых ингредиента!'
+            )
+        found = Ingredient.objects.in_bulk(ingredient_ids)
+        missing = [pk for pk in ingredient_ids if pk not in found]
+        if missing:
+            raise NotFound(f'Ингредиенты не найдены: {missing}')
         return ingredients
 
     def validate_tags(self, tags):
@@ -196,11 +290,42 @@ class RecipeCreateOrUpdateSerializer(serializers.ModelSerializer):
         AmountOfIngredients.objects.bulk_create(
             [AmountOfIngredients(
                 recipe=recipe,
-                ingredient=Ingredient.objects.get(id=ingredient['id']),
+                ingredient_id=ingredient['id'],
                 amount=ingredient['amount']
             ) for ingredient in ingredients]
         )
 
+    def update_ingredients_amounts(self, ingredients, recipe):
+        """Приводит состав рецепта к ingredients, выполняя только нужные
+        вставки, обновления и удаления. Возвращает старый и новый состав
+        в виде {id ингредиента: количество}."""
+        current = {
+            amount.ingredient_id: amount
+            for amount in AmountOfIngredients.objects.filter(recipe=recipe)}
+        old_amounts = {
+            ingredient_id: amount.amount
+            for ingredient_id, amount in current.items()}
+        new_amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients}
+        removed = current.keys() - new_amounts.keys()
+        if removed:
+            AmountOfIngredients.objects.filter(
+                recipe=recipe, ingredient_id__in=removed).delete()
+        changed = []
+        for ingredient_id, amount in new_amounts.items():
+            row = current.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        AmountOfIngredients.objects.bulk_update(changed, ('amount',))
+        self.create_ingredients_amounts(
+            [ingredient for ingredient in ingredients
+             if ingredient['id'] not in current],
+            recipe)
+        return old_amounts, new_amounts
+
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context.get('request').user
         tags = validated_data.pop('tags')
@@ -209,26 +334,48 @@ class RecipeCreateOrUpdateSerializer(serializers.ModelSerializer):
         recipe.tags.set(tags)
         self.create_ingredients_amounts(recipe=recipe,
                                         ingredients=ingredients)
+        ingredient_ids = [ingredient['id'] for ingredient in ingredients]
+        transaction.on_commit(
+            lambda: recipe_index.update_recipe(recipe.pk, ingredient_ids))
+        schedule_variants(recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.create_ingredients_amounts(recipe=instance,
-                                        ingredients=ingredients)
-        return super().update(instance, validated_data)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            old_amounts, new_amounts = self.update_ingredients_amounts(
+                recipe=instance, ingredients=ingredients)
+            ShoppingCartTotal.objects.change_recipe(
+                instance, old_amounts, new_amounts)
+            transaction.on_commit(lambda: recipe_index.update_recipe(
+                instance.pk, list(new_amounts)))
+        stale_variants = None
+        if 'image' in validated_data:
+            stale_variants = instance.image_variants
+            validated_data['image_variants'] = {}
+        instance = super().update(instance, validated_data)
+        if stale_variants is not None:
+            schedule_variants(instance, stale_variants)
+        return instance
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        fields = get_selected_fields(
+            request, RecipeReadOnlySerializer.Meta.fields)
+        instance = Recipe.objects.with_relations(fields).with_user_flags(
+            request.user, fields).get(pk=instance.pk)
         return RecipeReadOnlySerializer(
             instance,
             context=self.context
         ).data
 
 
-class RecipeReadOnlySerializer(serializers.ModelSerializer):
+class RecipeReadOnlySerializer(SparseFieldsMixin, ImageVariantsMixin,
+                               serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     author = UserReadOnlySerializer(read_only=True)
     ingredients = IngredientsReadOnlySerializer(source='recipes',
@@ -236,6 +383,7 @@ class RecipeReadOnlySerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -248,22 +396,31 @@ class RecipeReadOnlySerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_variants',
             'text',
             'cooking_time',
         )
 
     def get_is_favorited(self, recipe):
         user = self.context.get('request').user
-        if not user.is_anonymous:
-            return user.favorites.filter(recipe=recipe).exists()
+        if user.is_anonymous:
+            return None
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
+        return user.favorites.filter(recipe=recipe).exists()
 
     def get_is_in_shopping_cart(self, recipe):
         user = self.context.get('request').user
-        if not user.is_anonymous:
-            return user.shoppinglist.filter(recipe=recipe).exists()
+        if user.is_anonymous:
+            return None
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
+        return user.shoppinglist.filter(recipe=recipe).exists()
 
 
-class FavoriteRecipeSerializer(serializers.ModelSerializer):
+class FavoriteRecipeSerializer(ImageVariantsMixin,
+                               serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -271,14 +428,53 @@ class FavoriteRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_variants',
             'cooking_time'
         )
 
 
-class SubscriptionSerializer(UserSerializer):
+class CookableRecipeSerializer(FavoriteRecipeSerializer):
+    """Рецепт из поиска по имеющимся ингредиентам. Атрибуты matched_count,
+    ingredients_count и missing_ingredients заполняет представление."""
+    matched_count = serializers.ReadOnlyField()
+    ingredients_count = serializers.ReadOnlyField()
+    coverage = serializers.SerializerMethodField()
+    missing_ingredients = IngredientsReadOnlySerializer(many=True,
+                                                        read_only=True)
+
+    class Meta(FavoriteRecipeSerializer.Meta):
+        fields = FavoriteRecipeSerializer.Meta.fields + (
+            'matched_count',
+            'ingredients_count',
+            'coverage',
+            'missing_ingredients',
+        )
+
+    def get_coverage(self, recipe):
+        return round(recipe.matched_count / recipe.ingredients_count, 2)
+
+
+class CookSearchSerializer(serializers.Serializer):
+    ingredients = serializers.CharField(max_length=2000)
+
+    def validate_ingredients(self, ingredients):
+        try:
+            ingredient_ids = {
+                int(pk) for pk in ingredients.split(',') if pk.strip()}
+        except ValueError:
+            raise serializers.ValidationError(
+                'Укажите id ингредиентов через запятую!')
+        if not ingredient_ids:
+            raise serializers.ValidationError(
+                'Укажите хотя бы один ингредиент!')
+        return ingredient_ids
+
+
+class SubscriptionSerializer(SparseFieldsMixin, SubscribedMixin,
+                             UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -293,34 +489,45 @@ class SubscriptionSerializer(UserSerializer):
             'recipes_count',
         )
 
-    def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (
-            user.is_authenticated
-            and user.subscriber.filter(author=obj).exists())
-
     def get_recipes(self, author):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = author.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
+        author_recipes = self.context.get('author_recipes')
+        if author_recipes is not None:
+            recipes = author_recipes.get(author.pk, [])
+        else:
+            recipes = author.recipes.all()
+            limit = self.context.get('recipes_limit')
+            if limit is not None:
+                recipes = recipes[:limit]
         serializer = FavoriteRecipeSerializer(
             recipes, many=True, read_only=True)
         return serializer.data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
 
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES)
+
+
+class RecipesLimitSerializer(serializers.Serializer):
+    recipes_limit = serializers.IntegerField(
+        required=False, min_value=0, max_value=MAX_UNIT_AMOUNT)
+
+
+class ShoppingListFormatSerializer(serializers.Serializer):
+    format = serializers.ChoiceField(
+        choices=('txt', 'csv', 'json'), default='txt')
 
-class SubscribeSerializer(UserSerializer):
+
+class SubscribeSerializer(SubscribedMixin, UserSerializer):
     email = serializers.ReadOnlyField()
     username = serializers.ReadOnlyField()
     first_name = serializers.ReadOnlyField()
     last_name = serializers.ReadOnlyField()
     is_subscribed = serializers.SerializerMethodField()
     recipes = FavoriteRecipeSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -346,15 +553,6 @@ class SubscribeSerializer(UserSerializer):
                 {'errors': 'Нельзя подписаться на самого себя!'})
         return data
 
-    def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (
-            user.is_authenticated
-            and user.subscriber.filter(author=obj).exists())
-
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
 
 class FavoriteSerializer(serializers.ModelSerializer):
 
@@ -0,0 +1,44 @@
+import csv
+import json
+
+'''Построчная генерация файла списка покупок в разных форматах.'''
+
+
+class Echo:
+    """Псевдобуфер: csv.writer возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def render_txt(items):
+    yield 'Список покупок:\n'
+    for count, (name, measurement_unit, amount) in enumerate(items, 1):
+        yield f'{count}. {name} ({measurement_unit}) — {amount}\n'
+
+
+def render_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in items:
+        yield writer.writerow(row)
+
+
+def render_json(items):
+    separator = ''
+    yield '['
+    for name, measurement_unit, amount in items:
+        yield separator + json.dumps(
+            {'name': name,
+             'measurement_unit': measurement_unit,
+             'amount': amount},
+            ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+SHOPPING_LIST_FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'json': (render_json, 'application/json; charset=utf-8'),
+}
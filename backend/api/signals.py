@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.counters import is_updated_in_bulk
+from recipes.models import (AmountOfIngredients, Favorite, Ingredient,
+                            Recipe, ShoppingList, Tag)
+from users.models import Subscription, User
+from .authentication import token_cache
+from .caching import bump_table_version
+from .catalog import ingredient_catalog, tag_catalog
+
+
+# Модели, по которым строятся постраничные выборки API. Обработчики
+# post_delete отключают быстрое каскадное удаление, поэтому подключаются
+# только к ним.
+PAGINATED_MODELS = (Recipe, Favorite, ShoppingList, Tag, User, Subscription)
+# Модели, из которых собираются кэшируемые ответы RecipeViewSet.
+RESPONSE_CACHE_MODELS = (Recipe, AmountOfIngredients, Tag, Ingredient)
+
+
+def invalidate_table_cache(sender, **kwargs):
+    if not is_updated_in_bulk():
+        bump_table_version(sender._meta.db_table)
+
+
+def invalidate_response_cache(sender, **kwargs):
+    # Повторная смена версии после фиксации транзакции не дает
+    # закэшировать ответ, собранный до нее из старых данных.
+    table = sender._meta.db_table
+    transaction.on_commit(lambda: bump_table_version(table))
+
+
+for model in PAGINATED_MODELS:
+    post_save.connect(invalidate_table_cache, sender=model)
+    post_delete.connect(invalidate_table_cache, sender=model)
+
+for model in RESPONSE_CACHE_MODELS:
+    post_save.connect(invalidate_response_cache, sender=model)
+    post_delete.connect(invalidate_response_cache, sender=model)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_m2m_table_cache(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_table_version(sender._meta.db_table)
+        invalidate_response_cache(sender)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_catalog(sender, **kwargs):
+    ingredient_catalog.invalidate()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_catalog(sender, **kwargs):
+    tag_catalog.invalidate()
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    token_cache.invalidate((instance.key,))
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, update_fields=None,
+                           **kwargs):
+    """Смена пароля, деактивация и другие изменения пользователя
+    сбрасывают закэшированные токены вместе с копией пользователя."""
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    token_cache.invalidate(
+        Token.objects.filter(user=instance).values_list('key', flat=True))
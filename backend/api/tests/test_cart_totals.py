@@ -0,0 +1,146 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import (AmountOfIngredients, Ingredient, Recipe,
+                            ShoppingCartTotal, ShoppingList, Tag)
+from users.models import User
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'cart-totals-tests',
+}})
+class ShoppingCartTotalTest(TestCase):
+    """Сохраненные итоги списков покупок совпадают с суммами, посчитанными
+    по рецептам (ShoppingCartTotal.objects.calculate), после каждого
+    изменения."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@test.ru')
+        cls.buyers = [
+            User.objects.create(username=f'buyer-{number}',
+                                email=f'buyer-{number}@test.ru')
+            for number in range(2)]
+        cls.tag = Tag.objects.create(
+            name='tag', color='#000000', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ingredient-{number}', measurement_unit='г')
+            for number in range(4)]
+        cls.recipes = []
+        for number, amounts in enumerate(((10, 20, 0, 0), (5, 0, 7, 0))):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'recipe-{number}', text='text',
+                cooking_time=1)
+            recipe.tags.set((cls.tag,))
+            AmountOfIngredients.objects.bulk_create(
+                AmountOfIngredients(
+                    recipe=recipe, ingredient=ingredient, amount=amount)
+                for ingredient, amount in zip(cls.ingredients, amounts)
+                if amount)
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_client(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def get_totals(self, user):
+        return dict(ShoppingCartTotal.objects.filter(user=user).values_list(
+            'ingredient_id', 'total_amount'))
+
+    def assertTotalsInSync(self):
+        user_ids = [buyer.pk for buyer in self.buyers]
+        stored = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount
+            in ShoppingCartTotal.objects.filter(
+                user_id__in=user_ids).values_list(
+                    'user_id', 'ingredient_id', 'total_amount')}
+        self.assertEqual(
+            stored, ShoppingCartTotal.objects.calculate(user_ids))
+
+    def test_apply_deltas(self):
+        buyer = self.buyers[0]
+        first, second, third, _ = self.ingredients
+        ShoppingCartTotal.objects.apply_deltas(
+            (buyer.pk,), {first.pk: 5, second.pk: 3})
+        self.assertEqual(self.get_totals(buyer), {first.pk: 5, second.pk: 3})
+        ShoppingCartTotal.objects.apply_deltas(
+            (buyer.pk,), {first.pk: -5, second.pk: 2, third.pk: 0})
+        self.assertEqual(self.get_totals(buyer), {second.pk: 5})
+
+    def test_add_and_remove(self):
+        client = self.get_client(self.buyers[0])
+        for recipe in self.recipes:
+            response = client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+            self.assertEqual(response.status_code, 201)
+            self.assertTotalsInSync()
+        first, second, third, _ = self.ingredients
+        self.assertEqual(self.get_totals(self.buyers[0]),
+                         {first.pk: 15, second.pk: 20, third.pk: 7})
+        response = client.delete(
+            f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        self.assertEqual(response.status_code, 204)
+        self.assertTotalsInSync()
+        self.assertEqual(self.get_totals(self.buyers[0]),
+                         {first.pk: 5, third.pk: 7})
+
+    def test_recipe_edit(self):
+        for buyer in self.buyers:
+            ShoppingList.objects.create(user=buyer, recipe=self.recipes[0])
+        first, _, third, fourth = self.ingredients
+        response = self.get_client(self.author).patch(
+            f'/api/recipes/{self.recipes[0].pk}/',
+            {'ingredients': [{'id': first.pk, 'amount': 1},
+                             {'id': fourth.pk, 'amount': 4}]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTotalsInSync()
+        self.assertEqual(self.get_totals(self.buyers[1]),
+                         {first.pk: 1, fourth.pk: 4})
+
+    def test_tracking(self):
+        recipe = self.recipes[1]
+        ShoppingList.objects.create(user=self.buyers[0], recipe=recipe)
+        first, _, third, fourth = self.ingredients
+        with ShoppingCartTotal.objects.tracking((recipe.pk,)):
+            AmountOfIngredients.objects.filter(
+                recipe=recipe, ingredient=first).update(amount=50)
+            AmountOfIngredients.objects.filter(
+                recipe=recipe, ingredient=third).delete()
+            AmountOfIngredients.objects.create(
+                recipe=recipe, ingredient=fourth, amount=3)
+        self.assertTotalsInSync()
+        self.assertEqual(self.get_totals(self.buyers[0]),
+                         {first.pk: 50, fourth.pk: 3})
+
+    def test_recipe_delete(self):
+        for recipe in self.recipes:
+            ShoppingList.objects.create(user=self.buyers[0], recipe=recipe)
+        response = self.get_client(self.author).delete(
+            f'/api/recipes/{self.recipes[0].pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertTotalsInSync()
+        first, _, third, _ = self.ingredients
+        self.assertEqual(self.get_totals(self.buyers[0]),
+                         {first.pk: 5, third.pk: 7})
+
+    def test_repeated_delete_is_subtracted_once(self):
+        buyer = self.buyers[0]
+        for recipe in self.recipes:
+            ShoppingList.objects.create(user=buyer, recipe=recipe)
+        first_copy = ShoppingList.objects.get(
+            user=buyer, recipe=self.recipes[0])
+        second_copy = ShoppingList.objects.get(pk=first_copy.pk)
+        first_copy.delete()
+        second_copy.delete()
+        self.assertTotalsInSync()
+        first, _, third, _ = self.ingredients
+        self.assertEqual(self.get_totals(buyer), {first.pk: 5, third.pk: 7})
@@ -0,0 +1,90 @@
+import base64
+import json
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe
+from users.models import Subscription, User
+
+
+def encode_cursor(position):
+    return base64.urlsafe_b64encode(
+        json.dumps(position).encode('ascii')).decode('ascii')
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'pagination-tests',
+}})
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create(
+            username='viewer', email='viewer@test.ru')
+        cls.authors = []
+        for number in range(5):
+            author = User.objects.create(
+                username=f'author-{number}', email=f'a{number}@test.ru')
+            Recipe.objects.create(
+                author=author, name=f'recipe-{number}', text='text',
+                cooking_time=1)
+            Subscription.objects.create(user=cls.viewer, author=author)
+            cls.authors.append(author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def get_ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return ([item['id'] for item in response.json()['results']],
+                response.json()['next'])
+
+    def test_malformed_cursor(self):
+        for cursor in ('%%%', 'bm90IGpzb24=', encode_cursor({'id': 1}),
+                       encode_cursor(['2020-01-01T00:00:00+00:00'])):
+            with self.subTest(cursor):
+                response = self.client.get(
+                    '/api/recipes/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_wrong_typed_cursor(self):
+        for position in (['not a date', 1],
+                         ['2020-01-01T00:00:00+00:00', 'abc'],
+                         [None, 1],
+                         [[], {}]):
+            with self.subTest(position):
+                response = self.client.get(
+                    '/api/recipes/', {'cursor': encode_cursor(position)})
+                self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            '/api/users/', {'cursor': encode_cursor(['abc'])})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_is_stable_across_inserts(self):
+        expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('id', flat=True))
+        first_page, next_url = self.get_ids('/api/recipes/?cursor=&limit=2')
+        self.assertEqual(first_page, expected[:2])
+        Recipe.objects.create(
+            author=self.authors[0], name='new', text='text', cooking_time=1)
+        second_page, next_url = self.get_ids(next_url)
+        self.assertEqual(second_page, expected[2:4])
+        third_page, next_url = self.get_ids(next_url)
+        self.assertEqual(third_page, expected[4:])
+        self.assertIsNone(next_url)
+
+    def test_subscriptions_cursor(self):
+        expected = [author.pk for author in self.authors]
+        response = self.client.get('/api/users/subscriptions/?cursor=&limit=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.json())
+        first_page = [item['id'] for item in response.json()['results']]
+        second_page, next_url = self.get_ids(response.json()['next'])
+        self.assertEqual(first_page + second_page, expected)
+        self.assertIsNone(next_url)
@@ -0,0 +1,42 @@
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from api.scenarios import EndpointScenarios
+
+SIZES = (1, 10, 100)
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'query-budget-tests',
+}})
+class QueryBudgetTest(EndpointScenarios, TestCase):
+    """Число SQL-запросов к эндпоинтам не растет вместе с количеством
+    данных (защита от N+1)."""
+
+    def get(self, scenario, size):
+        """Создает данные размера size и очищает кэш; данные откатывает
+        вызывающий код."""
+        client, url = scenario(size)
+        # Ответы и количества из кэша не должны скрывать запросы.
+        cache.clear()
+        return client, url
+
+    def test_query_count_does_not_depend_on_size(self):
+        for name, scenario in self.get_scenarios():
+            with self.subTest(name):
+                with transaction.atomic():
+                    client, url = self.get(scenario, SIZES[0])
+                    with CaptureQueriesContext(connection) as context:
+                        response = client.get(url)
+                    self.assertEqual(response.status_code, 200, url)
+                    transaction.set_rollback(True)
+                for size in SIZES[1:]:
+                    with transaction.atomic():
+                        client, url = self.get(scenario, size)
+                        with self.assertNumQueries(len(context)):
+                            response = client.get(url)
+                        self.assertEqual(response.status_code, 200, url)
+                        transaction.set_rollback(True)
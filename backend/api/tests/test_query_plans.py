@@ -0,0 +1,98 @@
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.scenarios import PREFIX, EndpointScenarios
+from users.models import User
+
+SIZE = 50
+PASSWORD = 'Querybudget-Pa55'
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'query-plan-tests',
+}})
+class QueryPlanTest(EndpointScenarios, TestCase):
+    """Ни один запрос основных эндпоинтов не читает таблицу целиком
+    вместо индекса."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tables = set(connection.introspection.table_names())
+
+    def get_scenarios(self):
+        return super().get_scenarios() + (
+            ('GET /api/recipes/?author={id}', self.recipes_by_author),
+            ('POST /api/auth/token/login/', self.login),
+        )
+
+    def test_queries_use_indexes(self):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.skipTest(
+                f'Unsupported database backend: {connection.vendor}')
+        for name, scenario in self.get_scenarios():
+            with self.subTest(name):
+                self.assertEqual(self.explain(scenario), [])
+
+    def explain(self, scenario):
+        """Создает данные, выполняет запрос и возвращает строки планов
+        SELECT с полным просмотром таблицы; данные откатываются."""
+        problems = []
+        with transaction.atomic():
+            client, url, *data = scenario(SIZE)
+            cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                if data:
+                    response = client.post(url, data[0], format='json')
+                else:
+                    response = client.get(url)
+            self.assertIn(response.status_code, (200, 201), url)
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    # Последовательное чтение остается в плане, только если
+                    # подходящего индекса нет совсем.
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+                for query in context.captured_queries:
+                    sql = query['sql']
+                    if not sql.lstrip().upper().startswith('SELECT'):
+                        continue
+                    problems.extend(
+                        (sql, line) for line in self.get_plan(cursor, sql)
+                        if self.is_full_scan(line, sql))
+            transaction.set_rollback(True)
+        return problems
+
+    def get_plan(self, cursor, sql):
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+    def is_full_scan(self, line, sql):
+        if connection.vendor == 'postgresql':
+            return 'Seq Scan' in line
+        # SQLite не умеет запрещать полный просмотр, поэтому ошибкой
+        # считается "SCAN <таблица>" без индекса в запросе с условием
+        # WHERE. Обход таблицы по rowid для выборки без условий (например,
+        # страница пользователей по id) и подзапросы допустимы.
+        words = line.split()
+        return (len(words) == 2 and words[0] == 'SCAN'
+                and words[1] in self.tables and ' WHERE ' in sql)
+
+    def recipes_by_author(self, size):
+        viewer = self.create_fixture(size)
+        author = User.objects.filter(
+            username__startswith=f'{PREFIX}-author-').first()
+        return (self.get_client(viewer),
+                f'/api/recipes/?author={author.pk}&limit=6')
+
+    def login(self, size):
+        viewer = self.create_fixture(size)
+        viewer.set_password(PASSWORD)
+        viewer.save(update_fields=('password',))
+        return (APIClient(), '/api/auth/token/login/',
+                {'email': viewer.email, 'password': PASSWORD})
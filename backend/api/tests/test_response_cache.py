@@ -0,0 +1,47 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import Recipe
+from users.models import User
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'response-cache-tests',
+}})
+class AnonymousResponseCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='author', email='a@test.ru')
+        for number in range(2):
+            Recipe.objects.create(
+                author=author, name=f'recipe-{number}', text='text',
+                cooking_time=1)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cache_key_depends_on_host(self):
+        client = APIClient()
+        response = client.get(
+            '/api/recipes/?limit=1', HTTP_HOST='evil.example')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        response = client.get(
+            '/api/recipes/?limit=1', HTTP_HOST='foodgram.example')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.json()['next'].startswith(
+            'http://foodgram.example/'))
+        response = client.get(
+            '/api/recipes/?limit=1', HTTP_HOST='foodgram.example')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertTrue(response.json()['next'].startswith(
+            'http://foodgram.example/'))
+
+    def test_cache_key_depends_on_scheme(self):
+        client = APIClient()
+        client.get('/api/recipes/?limit=1')
+        response = client.get('/api/recipes/?limit=1', secure=True)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertTrue(response.json()['next'].startswith('https://'))
@@ -0,0 +1,59 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import token_cache
+from users.models import User
+
+PASSWORD = 'Token-cache-Pa55'
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'token-cache-tests',
+}})
+class TokenCacheInvalidationTest(TestCase):
+    """Закэшированный токен перестает действовать сразу после выхода,
+    смены пароля, деактивации и удаления пользователя."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='user', email='user@test.ru')
+        self.user.set_password(PASSWORD)
+        self.user.save()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertIsNotNone(token_cache.get(self.token.key))
+
+    def tearDown(self):
+        token_cache.invalidate((self.token.key,))
+
+    def assertTokenRejected(self):
+        self.assertIsNone(token_cache.get(self.token.key))
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_logout(self):
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertTokenRejected()
+
+    def test_set_password(self):
+        response = self.client.post('/api/users/set_password/', {
+            'current_password': PASSWORD,
+            'new_password': 'Token-cache-Pa55-new'})
+        self.assertEqual(response.status_code, 204)
+        self.assertTokenRejected()
+
+    def test_deactivation(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertTokenRejected()
+
+    def test_user_delete(self):
+        self.user.delete()
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+        self.assertTokenRejected()
@@ -3,7 +3,7 @@ from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from .views import (CustomUserViewSet, TagViewSet,
-                    IngredientViewSet, RecipeViewSet)
+                    IngredientViewSet, RecipeViewSet, TokenCacheStatsView)
 
 app_name = 'api'
 
@@ -16,6 +16,7 @@ router_v1.register(r'recipes', RecipeViewSet, basename='recipes')
 router_v1.register(r'ingredients', IngredientViewSet, basename='ingredients')
 
 urlpatterns = [
+    path('auth/token/cache-stats/', TokenCacheStatsView.as_view()),
     path('', include(router_v1.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -1,31 +1,47 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from collections import defaultdict
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import (IsAuthenticated, AllowAny)
+from rest_framework.permissions import (IsAuthenticated, AllowAny,
+                                        IsAdminUser)
+from rest_framework.views import APIView
 
 from .serializers import (
     CreateUserSerializer, UserReadOnlySerializer, SetPasswordSerializer,
     TagSerializer, IngredientSerializer, RecipeCreateOrUpdateSerializer,
     RecipeReadOnlySerializer, FavoriteRecipeSerializer, FavoriteSerializer,
-    SubscriptionSerializer, SubscribeSerializer, ShoppingCartSerializer)
-from .pagination import LimitPagesPagination
+    SubscriptionSerializer, SubscribeSerializer, ShoppingCartSerializer,
+    RecipesLimitSerializer, ShoppingListFormatSerializer,
+    IngredientSearchSerializer, CookSearchSerializer, RecipeIdsSerializer,
+    CookableRecipeSerializer, get_selected_fields)
+from .pagination import (LimitPagesPagination, KeysetPagination,
+                         LimitPagesOrKeysetPagination)
 from .permissions import IsAdminOrReadOnly, IsAdminOrAuthorOrReadOnly
-from .filters import IngredientFilter, RecipeFilter
-from . viewsets import CreateReadViewSet
+from .authentication import token_cache
+from .caching import bump_table_version
+from .filters import RecipeFilter
+from .catalog import ingredient_catalog, tag_catalog
+from .negotiation import IgnoreFormatContentNegotiation
+from .shopping_list import SHOPPING_LIST_FORMATS
+from . viewsets import AnonymousCacheMixin, CreateReadViewSet
 
 from users.models import User, Subscription
+from recipes.counters import change_counter, updated_in_bulk
+from recipes.indexes import ingredient_index, recipe_index
 from recipes.models import (Tag, Ingredient, Recipe, Favorite, ShoppingList,
-                            AmountOfIngredients)
+                            ShoppingCartTotal, AmountOfIngredients)
 
 
 class CustomUserViewSet(CreateReadViewSet):
     queryset = User.objects.all()
     permission_classes = (AllowAny,)
+    cursor_ordering = ('id',)
 
     def get_serializer_class(self):
         if self.action in ('list', 'retrieve'):
@@ -36,8 +52,10 @@ class CustomUserViewSet(CreateReadViewSet):
             pagination_class=None,
             permission_classes=(IsAuthenticated,))
     def me(self, request):
+        # request.user из кэша токенов содержит только id и is_active.
         serializer = UserReadOnlySerializer(
-            request.user, context={'request': request})
+            User.objects.get(pk=request.user.pk),
+            context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['post'],
@@ -76,13 +94,22 @@ class CustomUserViewSet(CreateReadViewSet):
         permission_classes=[IsAuthenticated]
     )
     def subscriptions(self, request):
-        user = request.user
-        queryset = User.objects.filter(subscribing__user=user)
+        limit_serializer = RecipesLimitSerializer(data=request.query_params)
+        limit_serializer.is_valid(raise_exception=True)
+        limit = limit_serializer.validated_data.get('recipes_limit')
+        fields = get_selected_fields(
+            request, SubscriptionSerializer.Meta.fields)
+        queryset = User.objects.filter(
+            subscribing__user=request.user).order_by('id')
         pages = self.paginate_queryset(queryset)
+        context = {'request': request, 'recipes_limit': limit}
+        if 'recipes' in fields:
+            context['author_recipes'] = Recipe.objects.latest_by_author(
+                pages, limit)
         serializer = SubscriptionSerializer(
             pages,
             many=True,
-            context={'request': request})
+            context=context)
         return self.get_paginated_response(serializer.data)
 
 
@@ -91,24 +118,47 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (IsAdminOrReadOnly,)
     serializer_class = TagSerializer
 
+    def list(self, request, *args, **kwargs):
+        return tag_catalog.response(request)
+
 
 class IngredientViewSet(viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
     permission_classes = (IsAdminOrReadOnly,)
     serializer_class = IngredientSerializer
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
 
+    def list(self, request, *args, **kwargs):
+        search_serializer = IngredientSearchSerializer(
+            data=request.query_params)
+        search_serializer.is_valid(raise_exception=True)
+        name = search_serializer.validated_data.get('name')
+        if not name:
+            return ingredient_catalog.response(request)
+        return Response(ingredient_index.search(
+            name, search_serializer.validated_data.get('limit')))
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(AnonymousCacheMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = (IsAdminOrAuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
-    pagination_class = LimitPagesPagination
+    pagination_class = LimitPagesOrKeysetPagination
+    cursor_ordering = ('-pub_date', '-id')
+    cache_models = (Recipe, Recipe.tags.through, AmountOfIngredients, Tag,
+                    Ingredient)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fields = None
+        if self.action in ('list', 'retrieve', 'feed', 'trending'):
+            fields = get_selected_fields(
+                self.request, RecipeReadOnlySerializer.Meta.fields)
+            queryset = queryset.with_relations(fields)
+        return queryset.with_user_flags(self.request.user, fields)
 
     def get_serializer_class(self):
-        if self.action in ('list', 'retrieve'):
+        if self.action in ('list', 'retrieve', 'feed', 'trending'):
             return RecipeReadOnlySerializer
         return RecipeCreateOrUpdateSerializer
 
@@ -121,8 +171,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer = ShoppingCartSerializer(
                 data={'user': request.user.id, 'recipe': recipe.id}
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
+            # Итоги списка покупок обновляются сигналами в той же
+            # транзакции.
+            with transaction.atomic():
+                self.lock_user(request)
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
             favorite_recipe_serializer = FavoriteRecipeSerializer(recipe)
             return Response(
                 favorite_recipe_serializer.data, status=status.HTTP_201_CREATED
@@ -142,8 +196,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer = FavoriteSerializer(
                 data={'user': request.user.id, 'recipe': recipe.id}
             )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
+            with transaction.atomic():
+                self.lock_user(request)
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
             favorite_recipe_serializer = FavoriteRecipeSerializer(recipe)
             return Response(
                 favorite_recipe_serializer.data, status=status.HTTP_201_CREATED
@@ -155,21 +211,175 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['get'],
+            pagination_class=KeysetPagination,
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        queryset = self.get_queryset().feed(request.user)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'],
+            pagination_class=LimitPagesPagination)
+    def trending(self, request):
+        """Рецепты с рассчитанной популярностью (см. compute_trending),
+        от самых популярных."""
+        queryset = self.get_queryset().filter(
+            score__isnull=False).order_by('-score__score', '-score__recipe')
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'],
+            pagination_class=LimitPagesPagination)
+    def cook(self, request):
+        """Рецепты, которые можно приготовить из имеющихся ингредиентов,
+        от наиболее полно покрытых; для каждого - недостающие продукты."""
+        search_serializer = CookSearchSerializer(data=request.query_params)
+        search_serializer.is_valid(raise_exception=True)
+        on_hand = search_serializer.validated_data['ingredients']
+        page = self.paginate_queryset(recipe_index.rank(on_hand))
+        recipes = Recipe.objects.in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        missing = defaultdict(list)
+        for amount in (
+                AmountOfIngredients.objects
+                .filter(recipe_id__in=recipes)
+                .exclude(ingredient_id__in=on_hand)
+                .select_related('ingredient')
+                .order_by('ingredient__name')):
+            missing[amount.recipe_id].append(amount)
+        results = []
+        for recipe_id, matched_count, ingredients_count in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                continue
+            recipe.matched_count = matched_count
+            recipe.ingredients_count = ingredients_count
+            recipe.missing_ingredients = missing[recipe_id]
+            results.append(recipe)
+        serializer = CookableRecipeSerializer(
+            results, many=True, context={'request': request})
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='favorite', permission_classes=[IsAuthenticated])
+    def favorite_many(self, request):
+        recipe_ids = self.get_bulk_recipe_ids(request)
+        if request.method == 'POST':
+            return self.add_user_recipes(
+                request, Favorite, 'favorites_count', recipe_ids)
+        return self.remove_user_recipes(
+            request, Favorite, 'favorites_count', recipe_ids)
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart', permission_classes=[IsAuthenticated])
+    def shopping_cart_many(self, request):
+        recipe_ids = self.get_bulk_recipe_ids(request)
+        if request.method == 'POST':
+            return self.add_user_recipes(
+                request, ShoppingList, 'in_carts_count', recipe_ids,
+                ShoppingCartTotal.objects.add_recipes)
+        return self.remove_user_recipes(
+            request, ShoppingList, 'in_carts_count', recipe_ids,
+            ShoppingCartTotal.objects.remove_recipes)
+
+    @action(detail=False, methods=['delete'],
+            url_path='shopping_cart/clear',
             permission_classes=[IsAuthenticated])
+    def clear_shopping_cart(self, request):
+        return self.remove_user_recipes(
+            request, ShoppingList, 'in_carts_count',
+            on_removed=lambda user, recipe_ids: (
+                ShoppingCartTotal.objects.filter(user=user).delete()))
+
+    def lock_user(self, request):
+        """Блокирует пользователя до конца транзакции: одиночные и
+        массовые изменения избранного и списка покупок не дают
+        параллельно дважды учесть один рецепт в счетчиках и итогах."""
+        User.objects.select_for_update().get(pk=request.user.pk)
+
+    def get_bulk_recipe_ids(self, request):
+        ids_serializer = RecipeIdsSerializer(data=request.data)
+        ids_serializer.is_valid(raise_exception=True)
+        return list(dict.fromkeys(ids_serializer.validated_data['recipes']))
+
+    def add_user_recipes(self, request, model, counter, recipe_ids,
+                         on_added=None):
+        """Добавляет рецепты в избранное или список покупок одной вставкой
+        и возвращает результат по каждому id: added, exists, not_found."""
+        found = set(Recipe.objects.filter(
+            pk__in=recipe_ids).values_list('pk', flat=True))
+        with transaction.atomic():
+            self.lock_user(request)
+            existing = set(model.objects.filter(
+                user=request.user, recipe_id__in=found).values_list(
+                    'recipe_id', flat=True))
+            added = [
+                pk for pk in recipe_ids if pk in found and pk not in existing]
+            model.objects.bulk_create(
+                (model(user=request.user, recipe_id=pk) for pk in added),
+                ignore_conflicts=True)
+            change_counter(Recipe, added, counter, 1)
+            if on_added is not None:
+                on_added(request.user, added)
+        bump_table_version(model._meta.db_table)
+        return Response({'results': [
+            {'id': pk, 'status': (
+                'not_found' if pk not in found
+                else 'exists' if pk in existing else 'added')}
+            for pk in recipe_ids]})
+
+    def remove_user_recipes(self, request, model, counter, recipe_ids=None,
+                            on_removed=None):
+        """Удаляет рецепты recipe_ids (по умолчанию - все) из избранного
+        или списка покупок одним запросом DELETE и возвращает результат
+        по каждому id: removed или missing."""
+        with transaction.atomic():
+            self.lock_user(request)
+            queryset = model.objects.filter(user=request.user)
+            if recipe_ids is not None:
+                queryset = queryset.filter(recipe_id__in=recipe_ids)
+            removed = set(queryset.values_list('recipe_id', flat=True))
+            # Счетчики и итоги обновляются ниже одним запросом на все
+            # рецепты, а не обработчиками сигналов для каждой строки.
+            with updated_in_bulk():
+                queryset.delete()
+            change_counter(Recipe, removed, counter, -1)
+            if on_removed is not None:
+                on_removed(request.user, removed)
+        bump_table_version(model._meta.db_table)
+        if recipe_ids is None:
+            recipe_ids = sorted(removed)
+        return Response({'results': [
+            {'id': pk, 'status': 'removed' if pk in removed else 'missing'}
+            for pk in recipe_ids]})
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated],
+            content_negotiation_class=IgnoreFormatContentNegotiation)
     def download_shopping_cart(self, request):
-        user = self.request.user
-        ingredients = (AmountOfIngredients.objects.filter(
-            recipe__shoppinglist__user=request.user)
-            .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(amount=Sum('amount'))
+        format_serializer = ShoppingListFormatSerializer(
+            data=request.query_params)
+        format_serializer.is_valid(raise_exception=True)
+        file_format = format_serializer.validated_data['format']
+        render, content_type = SHOPPING_LIST_FORMATS[file_format]
+        ingredients = (
+            ShoppingCartTotal.objects.filter(user=request.user)
+            .values_list('ingredient__name', 'ingredient__measurement_unit',
+                         'total_amount')
+            .order_by('ingredient__name', 'ingredient__measurement_unit')
         )
-        count = 1
-        text = 'Список покупок:\n'
-        filename = f'{user.username}_shopping_list.txt'
-        for item in ingredients:
-            name, measurement_unit, amount = list(item.values())
-            text += f'{count}. {name} ({measurement_unit}) — {amount}\n'
-            count += 1
-        response = HttpResponse(text, content_type='text/plain; charset=utf-8')
+        filename = f'{request.user.username}_shopping_list.{file_format}'
+        response = StreamingHttpResponse(
+            render(ingredients.iterator()), content_type=content_type)
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
+
+
+class TokenCacheStatsView(APIView):
+    """Статистика кэша токенов процесса, обработавшего запрос."""
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(token_cache.stats())
@@ -1,5 +1,10 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
 from rest_framework import mixins
-from .pagination import LimitPagesPagination
+from rest_framework.response import Response
+from .caching import get_response_cache_key
+from .pagination import LimitPagesOrKeysetPagination
 from rest_framework import viewsets
 
 
@@ -7,4 +12,53 @@ class CreateReadViewSet(mixins.ListModelMixin,
                         mixins.RetrieveModelMixin,
                         mixins.CreateModelMixin,
                         viewsets.GenericViewSet):
-    pagination_class = LimitPagesPagination
+    pagination_class = LimitPagesOrKeysetPagination
+
+
+class AnonymousCacheMixin:
+    """Общий кэш ответов list и retrieve для анонимных посетителей.
+
+    Записи становятся недействительными при смене версии любой из
+    таблиц моделей cache_models (см. api.signals) и не живут дольше
+    RESPONSE_CACHE_TTL секунд. Кэшируются только ответы в JSON:
+    страницы Browsable API содержат CSRF-токен. Заголовок X-Cache
+    сообщает, взят ли ответ из кэша.
+    """
+    cache_models = ()
+    response_cache_key = None
+
+    def list(self, request, *args, **kwargs):
+        return (self.get_cached_response(request)
+                or super().list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return (self.get_cached_response(request)
+                or super().retrieve(request, *args, **kwargs))
+
+    def get_cached_response(self, request):
+        if (not request.user.is_anonymous
+                or request.accepted_renderer.format != 'json'):
+            return None
+        self.response_cache_key = get_response_cache_key(
+            request, [model._meta.db_table for model in self.cache_models])
+        cached = cache.get(self.response_cache_key)
+        if cached is None:
+            return None
+        content, content_type = cached
+        response = HttpResponse(content, content_type=content_type)
+        response['X-Cache'] = 'HIT'
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        if (self.response_cache_key is not None
+                and isinstance(response, Response)
+                and response.status_code == 200):
+            response.render()
+            cache.set(
+                self.response_cache_key,
+                (response.content, response['Content-Type']),
+                getattr(settings, 'RESPONSE_CACHE_TTL', 60))
+            response['X-Cache'] = 'MISS'
+        return response
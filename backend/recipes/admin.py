@@ -2,7 +2,8 @@ from django.contrib import admin
 
 from .models import (Tag, Ingredient, Recipe,
                      AmountOfIngredients, ShoppingList,
-                     Favorite, MIN_UNIT_AMOUNT)
+                     Favorite, ShoppingCartTotal, RecipeScore,
+                     MIN_UNIT_AMOUNT)
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -39,7 +40,8 @@ class RecipeAdmin(admin.ModelAdmin):
         'id',
         'author',
         'name',
-        'favorites',)
+        'favorites_count',
+        'in_carts_count',)
     list_filter = (
         'author',
         'name',
@@ -48,8 +50,10 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = (RecipeIngredientInline,)
     empty_value_display = '-пусто-'
 
-    def favorites(self, obj):
-        return obj.favorites.count()
+    def save_related(self, request, form, formsets, change):
+        # Состав из RecipeIngredientInline сохраняется здесь.
+        with ShoppingCartTotal.objects.tracking((form.instance.pk,)):
+            super().save_related(request, form, formsets, change)
 
 
 @admin.register(AmountOfIngredients)
@@ -60,6 +64,23 @@ class AmountOfIngredientsAdmin(admin.ModelAdmin):
     )
     list_filter = ('ingredient',)
 
+    def save_model(self, request, obj, form, change):
+        recipe_ids = {obj.recipe_id}
+        if change:
+            recipe_ids.update(AmountOfIngredients.objects.filter(
+                pk=obj.pk).values_list('recipe_id', flat=True))
+        with ShoppingCartTotal.objects.tracking(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with ShoppingCartTotal.objects.tracking((obj.recipe_id,)):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with ShoppingCartTotal.objects.tracking(set(
+                queryset.values_list('recipe_id', flat=True))):
+            super().delete_queryset(request, queryset)
+
 
 @admin.register(ShoppingList)
 class ShoppingListAdmin(admin.ModelAdmin):
@@ -81,3 +102,24 @@ class FavoriteAdmin(admin.ModelAdmin):
     list_filter = ('user', 'recipe')
     search_fields = ('user',)
     empty_value_display = '-пусто-'
+
+
+@admin.register(ShoppingCartTotal)
+class ShoppingCartTotalAdmin(admin.ModelAdmin):
+    list_display = (
+        'user',
+        'ingredient',
+        'total_amount'
+    )
+    list_filter = ('user',)
+    empty_value_display = '-пусто-'
+
+
+@admin.register(RecipeScore)
+class RecipeScoreAdmin(admin.ModelAdmin):
+    list_display = (
+        'recipe',
+        'score',
+        'computed_at'
+    )
+    empty_value_display = '-пусто-'
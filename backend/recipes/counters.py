@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Subscription, User
+from .models import Favorite, Recipe, ShoppingList
+
+'''Счетчики, хранящиеся в столбцах моделей вместо COUNT по связям.'''
+
+# (модель, столбец счетчика, модель связи, поле связи с моделью)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingList, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+)
+
+_updated_in_bulk = ContextVar('updated_in_bulk', default=False)
+
+
+@contextmanager
+def updated_in_bulk():
+    """Внутри блока обработчики сигналов не меняют счетчики, итоги
+    списков покупок и версии таблиц для каждой строки: вызывающий код
+    обновляет их сам одним запросом на все строки."""
+    token = _updated_in_bulk.set(True)
+    try:
+        yield
+    finally:
+        _updated_in_bulk.reset(token)
+
+
+def is_updated_in_bulk():
+    return _updated_in_bulk.get()
+
+
+def change_counter(model, pks, field, delta):
+    """Атомарно изменяет счетчик строк pks на delta одним запросом;
+    ниже нуля счетчик не опускается."""
+    queryset = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def change_counters(instance, delta):
+    """Изменяет на delta счетчики, которые считают строки модели
+    instance (например, избранное рецепта при добавлении Favorite)."""
+    for model, field, related_model, related_field in COUNTERS:
+        if isinstance(instance, related_model):
+            change_counter(model, (getattr(instance, f'{related_field}_id'),),
+                           field, delta)
+
+
+def get_actual_count(related_model, related_field):
+    """Выражение с фактическим числом связанных строк для каждой
+    строки модели счетчика."""
+    return Coalesce(Subquery(
+        related_model.objects.filter(**{related_field: OuterRef('pk')})
+        .order_by().values(related_field)
+        .annotate(count=Count('pk')).values('count')), 0)
@@ -0,0 +1,117 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps, features
+
+from .models import Recipe
+
+'''Фоновая подготовка уменьшенных копий фотографий рецептов.'''
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SIZES = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1200, 1200),
+}
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+# Форматы, сохраняющие прозрачность; в остальных прозрачные области
+# заливаются цветом фона.
+ALPHA_FORMATS = {'WEBP'}
+BACKGROUND_COLOR = (255, 255, 255)
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'IMAGE_VARIANT_WORKERS', 2),
+    thread_name_prefix='image-variants')
+
+
+def get_formats():
+    """Форматы, которые умеет кодировать установленная сборка Pillow."""
+    return {
+        extension: options
+        for extension, options in VARIANT_FORMATS.items()
+        if extension != 'webp' or features.check('webp')}
+
+
+def schedule_variants(recipe, stale_variants=None):
+    """Ставит генерацию копий в очередь после фиксации транзакции."""
+    image_name = recipe.image.name
+    if not image_name:
+        return
+    transaction.on_commit(lambda: _executor.submit(
+        generate_variants, recipe.pk, image_name, stale_variants or {}))
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+
+
+def flatten(image):
+    """Накладывает изображение с прозрачностью на белый фон."""
+    background = Image.new('RGB', image.size, BACKGROUND_COLOR)
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def render_variant(image, size, image_format, options):
+    variant = image.copy()
+    variant.thumbnail(size, Image.LANCZOS)
+    if variant.mode == 'RGBA' and image_format not in ALPHA_FORMATS:
+        variant = flatten(variant)
+    buffer = BytesIO()
+    # Метаданные (в том числе EXIF) не передаются в save и не сохраняются.
+    variant.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def build_variants(recipe_id, image_name, stale_variants):
+    """Готовит копии фотографии и сохраняет их имена в рецепте. Ошибки
+    чтения и кодирования не перехватываются."""
+    with default_storage.open(image_name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert('RGBA' if has_alpha(image) else 'RGB')
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    variants = {}
+    for variant, size in VARIANT_SIZES.items():
+        variants[variant] = {}
+        for extension, (image_format, options) in get_formats().items():
+            name = default_storage.save(
+                f'recipes/variants/{stem}/{variant}.{extension}',
+                ContentFile(render_variant(
+                    image, size, image_format, options)))
+            variants[variant][extension] = name
+    updated = Recipe.objects.filter(
+        pk=recipe_id, image=image_name).update(image_variants=variants)
+    if not updated:
+        # Пока копии готовились, фото заменили или рецепт удалили.
+        delete_variants(variants)
+    delete_variants(stale_variants)
+
+
+def generate_variants(recipe_id, image_name, stale_variants):
+    """Задача фонового потока: ошибки записываются в журнал, соединение
+    потока с базой закрывается. Копии, которые не удалось подготовить
+    здесь, досоздает команда build_image_variants."""
+    try:
+        build_variants(recipe_id, image_name, stale_variants)
+    except Exception:
+        logger.exception('Cannot build image variants for recipe %s',
+                         recipe_id)
+    finally:
+        connection.close()
+
+
+def delete_variants(variants):
+    for names in variants.values():
+        for name in names.values():
+            default_storage.delete(name)
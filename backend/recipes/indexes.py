@@ -0,0 +1,164 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+
+from django.conf import settings
+
+from .models import AmountOfIngredients, Ingredient
+
+'''Индексы в памяти процесса для быстрых поисковых запросов.'''
+
+
+class IngredientNameIndex:
+    """Отсортированный массив названий ингредиентов в нижнем регистре.
+
+    Строится при первом обращении и сбрасывается сигналами при изменении
+    ингредиентов. Изменения из других процессов (например, dbloader)
+    подхватываются не позже чем через INGREDIENT_INDEX_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = None
+        self._items = None
+        self._built_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._keys = None
+            self._items = None
+
+    def _get(self):
+        ttl = getattr(settings, 'INGREDIENT_INDEX_TTL', 300)
+        with self._lock:
+            if (self._keys is None
+                    or time.monotonic() - self._built_at > ttl):
+                entries = sorted(
+                    (name.casefold(), pk, name, measurement_unit)
+                    for pk, name, measurement_unit
+                    in Ingredient.objects.values_list(
+                        'id', 'name', 'measurement_unit'))
+                self._keys = [entry[0] for entry in entries]
+                self._items = [
+                    {'id': pk,
+                     'name': name,
+                     'measurement_unit': measurement_unit}
+                    for _, pk, name, measurement_unit in entries]
+                self._built_at = time.monotonic()
+            return self._keys, self._items
+
+    def search(self, query, limit=None):
+        """Сначала ингредиенты, начинающиеся с query, затем содержащие
+        query внутри названия; не больше limit результатов."""
+        keys, items = self._get()
+        query = query.casefold()
+        results = []
+        position = bisect_left(keys, query)
+        while position < len(keys) and keys[position].startswith(query):
+            if limit is not None and len(results) >= limit:
+                return results
+            results.append(items[position])
+            position += 1
+        for key, item in zip(keys, items):
+            if limit is not None and len(results) >= limit:
+                break
+            if query in key and not key.startswith(query):
+                results.append(item)
+        return results
+
+
+ingredient_index = IngredientNameIndex()
+
+
+class IngredientRecipeIndex:
+    """Инвертированный индекс: ингредиент -> отсортированные id рецептов.
+
+    Строится при первом обращении, обновляется при записи рецептов через
+    update_recipe и remove_recipe, а при изменении состава в обход
+    сериализатора (админка, ORM) - через refresh_recipe из сигналов.
+    Изменения из других процессов подхватываются не позже чем через
+    RECIPE_INDEX_TTL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+        self._recipes = None
+        self._built_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._postings = None
+            self._recipes = None
+
+    def _ensure_built(self):
+        ttl = getattr(settings, 'RECIPE_INDEX_TTL', 300)
+        if (self._postings is not None
+                and time.monotonic() - self._built_at <= ttl):
+            return
+        postings = {}
+        recipes = {}
+        rows = AmountOfIngredients.objects.values_list(
+            'recipe_id', 'ingredient_id').order_by(
+                'ingredient_id', 'recipe_id')
+        for recipe_id, ingredient_id in rows.iterator():
+            postings.setdefault(ingredient_id, []).append(recipe_id)
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        self._postings = postings
+        self._recipes = {
+            recipe_id: frozenset(ingredients)
+            for recipe_id, ingredients in recipes.items()}
+        self._built_at = time.monotonic()
+
+    def _remove(self, recipe_id):
+        for ingredient_id in self._recipes.pop(recipe_id, ()):
+            posting = self._postings[ingredient_id]
+            del posting[bisect_left(posting, recipe_id)]
+            if not posting:
+                del self._postings[ingredient_id]
+
+    def update_recipe(self, recipe_id, ingredient_ids):
+        with self._lock:
+            if self._postings is None:
+                return
+            self._remove(recipe_id)
+            self._recipes[recipe_id] = frozenset(ingredient_ids)
+            for ingredient_id in ingredient_ids:
+                insort(self._postings.setdefault(ingredient_id, []),
+                       recipe_id)
+
+    def remove_recipe(self, recipe_id):
+        with self._lock:
+            if self._postings is not None:
+                self._remove(recipe_id)
+
+    def refresh_recipe(self, recipe_id):
+        """Перечитывает состав рецепта из базы, если индекс построен."""
+        if self._postings is None:
+            return
+        ingredient_ids = list(AmountOfIngredients.objects.filter(
+            recipe_id=recipe_id).values_list('ingredient_id', flat=True))
+        if ingredient_ids:
+            self.update_recipe(recipe_id, ingredient_ids)
+        else:
+            self.remove_recipe(recipe_id)
+
+    def rank(self, ingredient_ids):
+        """Рецепты, в которых есть хотя бы один из ingredient_ids, в виде
+        (id рецепта, найдено ингредиентов, всего ингредиентов), от самых
+        полно покрытых к наименее покрытым."""
+        with self._lock:
+            self._ensure_built()
+            matched = Counter()
+            for ingredient_id in set(ingredient_ids):
+                matched.update(self._postings.get(ingredient_id, ()))
+            ranking = [
+                (recipe_id, count, len(self._recipes[recipe_id]))
+                for recipe_id, count in matched.items()]
+        ranking.sort(key=lambda item: (
+            -item[1] / item[2], -item[1], -item[0]))
+        return ranking
+
+
+recipe_index = IngredientRecipeIndex()
@@ -0,0 +1,49 @@
+from django.core.management import BaseCommand, CommandError
+
+from recipes.images import build_variants
+from recipes.models import Recipe
+
+'''Подготовка уменьшенных копий фотографий, которые не создал фоновый
+поток: задачи живут только в памяти процесса и теряются при его
+перезапуске, а ошибки лишь записываются в журнал.'''
+'''Запуск по расписанию: "python manage.py build_image_variants [--all]"'''
+
+
+class Command(BaseCommand):
+    help = 'Builds missing image variants of recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Rebuild variants of every recipe with an image')
+        parser.add_argument(
+            '--limit', type=int,
+            help='Process at most this many recipes')
+
+    def handle(self, *args, **options):
+        if options['limit'] is not None and options['limit'] < 1:
+            raise CommandError('--limit must be positive')
+        recipes = Recipe.objects.exclude(image='').exclude(
+            image__isnull=True).order_by('id')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        recipes = recipes.values_list('id', 'image', 'image_variants')
+        if options['limit'] is not None:
+            recipes = recipes[:options['limit']]
+        built = 0
+        failed = 0
+        for recipe_id, image_name, variants in recipes.iterator():
+            try:
+                build_variants(recipe_id, image_name, variants)
+            except Exception as error:
+                failed += 1
+                self.stderr.write(
+                    f'Cannot build image variants for recipe {recipe_id}: '
+                    f'{error}')
+            else:
+                built += 1
+        if failed:
+            raise CommandError(
+                f'Image variants of {failed} recipes were not built')
+        self.stdout.write(self.style.SUCCESS(
+            f'Image variants have been built for {built} recipes'))
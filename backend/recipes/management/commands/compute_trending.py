@@ -0,0 +1,58 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import Favorite, RecipeScore, ShoppingList
+
+'''Пересчет популярности рецептов (RecipeScore) для ?ordering=trending'''
+'''Запуск по расписанию: "python manage.py compute_trending"'''
+
+# Вес одного добавления рецепта в избранное или в список покупок.
+ACTIVITY_WEIGHTS = (
+    (Favorite, 1.0),
+    (ShoppingList, 1.5),
+)
+
+
+class Command(BaseCommand):
+    help = 'Recomputes time-decayed trending scores of recipes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--half-life', type=float,
+            default=getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 48),
+            help='Hours after which an action weighs half as much')
+        parser.add_argument(
+            '--window', type=int,
+            default=getattr(settings, 'TRENDING_WINDOW_DAYS', 14),
+            help='Only actions from the last N days are counted')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of scores inserted per query')
+
+    def handle(self, *args, **options):
+        half_life = options['half_life']
+        if half_life <= 0 or options['window'] < 1:
+            raise CommandError('--half-life and --window must be positive')
+        now = timezone.now()
+        since = now - timedelta(days=options['window'])
+        scores = defaultdict(float)
+        for model, weight in ACTIVITY_WEIGHTS:
+            actions = model.objects.filter(created__gte=since).values_list(
+                'recipe_id', 'created').order_by()
+            for recipe_id, created in actions.iterator():
+                age = (now - created).total_seconds() / 3600
+                scores[recipe_id] += weight * 0.5 ** (age / half_life)
+        with transaction.atomic():
+            RecipeScore.objects.all().delete()
+            RecipeScore.objects.bulk_create(
+                (RecipeScore(recipe_id=recipe_id, score=score,
+                             computed_at=now)
+                 for recipe_id, score in scores.items()),
+                batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Trending scores have been computed for {len(scores)} recipes'))
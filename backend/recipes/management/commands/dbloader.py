@@ -1,22 +1,109 @@
 import csv
-from django.core.management import BaseCommand
+import json
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
 
 from recipes.models import Ingredient
 
-'''Скрипт для импорта csv-файлов в базу данных'''
-'''Запуск скрипта через команду "python manage.py dbloader" в консоле'''
+'''Скрипт для импорта ингредиентов из csv- или json-файла в базу данных'''
+'''Запуск скрипта через команду "python manage.py dbloader [путь]" в консоле'''
+
+DEFAULT_PATH = os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv')
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file, delimiter=','):
+        if row:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    """Построчно разбирает json-массив объектов, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(JSON_CHUNK_SIZE)
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != '[':
+                    raise CommandError('JSON file must contain an array')
+                buffer = buffer[1:]
+                started = True
+                continue
+            if not buffer or buffer[0] == ']':
+                break
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('Malformed JSON file')
+                break
+            buffer = buffer[end:]
+            yield item['name'], item['measurement_unit']
+        if not chunk:
+            return
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
 
 
 class Command(BaseCommand):
-    help = 'Closes the specified poll for voting'
+    help = 'Loads the ingredient catalog from a CSV or JSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=DEFAULT_PATH,
+            help='CSV (name,measurement_unit) or JSON file to load')
+        parser.add_argument(
+            '--format', choices=tuple(READERS),
+            help='File format; detected by extension when omitted')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows inserted per query')
 
     def handle(self, *args, **options):
-        with open('data/ingredients.csv', encoding='utf8') as csv_file:
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            for row in csv_reader:
-                status, created = Ingredient.objects.update_or_create(
-                    name=row[0],
-                    measurement_unit=row[1]
-                )
-                self.stdout.write(
-                    "=The Ingredient database has been loaded successfully=")
+        path = options['path']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+        file_format = (options['format']
+                       or os.path.splitext(path)[1].lstrip('.').lower())
+        if file_format not in READERS:
+            raise CommandError(f'Unsupported file format: {path}')
+        started = time.monotonic()
+        total = 0
+        try:
+            with open(path, encoding='utf8') as file, transaction.atomic():
+                count_before = Ingredient.objects.count()
+                rows = READERS[file_format](file)
+                while True:
+                    batch = list(islice(rows, batch_size))
+                    if not batch:
+                        break
+                    Ingredient.objects.bulk_create(
+                        (Ingredient(name=name, measurement_unit=unit)
+                         for name, unit in batch),
+                        ignore_conflicts=True)
+                    total += len(batch)
+                inserted = Ingredient.objects.count() - count_before
+        except OSError as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'=The Ingredient database has been loaded successfully= '
+            f'inserted: {inserted}, skipped: {total - inserted}, '
+            f'{total / elapsed if elapsed else total:.0f} rows/s'))
@@ -0,0 +1,137 @@
+import base64
+import gzip
+import json
+from datetime import datetime
+
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from recipes.models import (AmountOfIngredients, Favorite, Ingredient,
+                            Recipe, ShoppingList, Tag)
+from users.models import Subscription, User
+
+'''Потоковая выгрузка рецептов и данных пользователей в JSON Lines'''
+'''Запуск: "python manage.py exportdata data.jsonl.gz [--since 2024-01-01]"'''
+'''Каждая строка - объект {"model": ..., "id": ..., поля}; ссылки на другие
+объекты - их id в исходной базе (их заменяет importdata).'''
+
+USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name',
+               'password', 'is_active', 'is_staff', 'is_superuser',
+               'date_joined')
+
+
+class Command(BaseCommand):
+    help = 'Streams recipes, tags and user data to a JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Output file; .gz is compressed')
+        parser.add_argument(
+            '--gzip', action='store_true',
+            help='Compress the output regardless of the file extension')
+        parser.add_argument(
+            '--since',
+            help='Only recipes, favorites and shopping lists created since '
+                 'this date or datetime (ISO 8601); catalogs, users and '
+                 'subscriptions are always exported in full')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Number of rows fetched from the database at a time')
+        parser.add_argument(
+            '--no-images', action='store_true',
+            help='Do not embed recipe image files')
+
+    def handle(self, *args, **options):
+        since = options['since'] and self.parse_since(options['since'])
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        self.chunk_size = options['chunk_size']
+        self.with_images = not options['no_images']
+        path = options['path']
+        opener = (gzip.open if options['gzip'] or path.endswith('.gz')
+                  else open)
+        counts = {}
+        with opener(path, 'wt', encoding='utf8') as file:
+            for model, rows in self.get_sections(since):
+                counts[model] = 0
+                for row in rows:
+                    file.write(json.dumps(
+                        {'model': model, **row}, cls=DjangoJSONEncoder,
+                        ensure_ascii=False))
+                    file.write('\n')
+                    counts[model] += 1
+        self.stdout.write(self.style.SUCCESS(
+            'Exported ' + ', '.join(
+                f'{model}: {count}' for model, count in counts.items())))
+
+    def parse_since(self, value):
+        try:
+            since = parse_datetime(value)
+            if since is None:
+                since = parse_date(value)
+                if since is not None:
+                    since = datetime.combine(since, datetime.min.time())
+        except ValueError:
+            since = None
+        if since is None:
+            raise CommandError('--since must be an ISO 8601 date')
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def get_sections(self, since):
+        recipes = Recipe.objects.all()
+        favorites = Favorite.objects.all()
+        shopping_lists = ShoppingList.objects.all()
+        if since is not None:
+            # Рецепты, добавленные в избранное или списки покупок после
+            # since, выгружаются, даже если опубликованы раньше.
+            recipes = recipes.filter(
+                Q(pub_date__gte=since)
+                | Q(pk__in=Favorite.objects.filter(
+                    created__gte=since).values('recipe'))
+                | Q(pk__in=ShoppingList.objects.filter(
+                    created__gte=since).values('recipe')))
+            favorites = favorites.filter(created__gte=since)
+            shopping_lists = shopping_lists.filter(created__gte=since)
+        return (
+            ('tag', self.iterate(Tag.objects.values(
+                'id', 'name', 'color', 'slug'))),
+            ('ingredient', self.iterate(Ingredient.objects.values(
+                'id', 'name', 'measurement_unit'))),
+            ('user', self.iterate(User.objects.values(*USER_FIELDS))),
+            ('recipe', self.get_recipes(recipes)),
+            ('recipe_tag', self.iterate(Recipe.tags.through.objects.filter(
+                recipe__in=recipes).values('recipe', 'tag'))),
+            ('amount', self.iterate(AmountOfIngredients.objects.filter(
+                recipe__in=recipes).values(
+                    'recipe', 'ingredient', 'amount'))),
+            ('favorite', self.iterate(favorites.values(
+                'user', 'recipe', 'created'))),
+            ('shopping_list', self.iterate(shopping_lists.values(
+                'user', 'recipe', 'created'))),
+            ('subscription', self.iterate(Subscription.objects.values(
+                'user', 'author'))),
+        )
+
+    def iterate(self, queryset):
+        return queryset.order_by('pk').iterator(chunk_size=self.chunk_size)
+
+    def get_recipes(self, queryset):
+        for recipe in self.iterate(queryset.values(
+                'id', 'author', 'name', 'text', 'cooking_time', 'pub_date',
+                'image')):
+            recipe['image_data'] = None
+            if self.with_images and recipe['image']:
+                try:
+                    with default_storage.open(recipe['image']) as image:
+                        recipe['image_data'] = base64.b64encode(
+                            image.read()).decode('ascii')
+                except OSError:
+                    self.stderr.write(
+                        f'Image {recipe["image"]} of recipe '
+                        f'{recipe["id"]} is missing')
+            yield recipe
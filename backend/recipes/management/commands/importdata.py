@@ -0,0 +1,318 @@
+import base64
+import binascii
+import gzip
+import json
+import os
+from contextlib import contextmanager
+from itertools import groupby, islice
+from operator import itemgetter
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import transaction
+
+from api.caching import bump_table_version
+from recipes.models import (AmountOfIngredients, Favorite, Ingredient,
+                            Recipe, ShoppingList, Tag, TimelineEntry)
+from recipes.search import update_search_index
+from users.models import Subscription, User
+
+from .exportdata import USER_FIELDS
+
+'''Загрузка файла, выгруженного командой exportdata'''
+'''Запуск: "python manage.py importdata data.jsonl.gz [--batch-size 1000]"'''
+'''Объекты сопоставляются с уже существующими по естественным ключам
+(slug тега, название и единица ингредиента, username, автор и название
+рецепта), поэтому повторная загрузка того же файла ничего не дублирует.
+Существующие объекты не изменяются, состав и теги обновляются только у
+новых рецептов.'''
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+@contextmanager
+def preserved_dates(*fields):
+    """Отключает auto_now_add, чтобы сохранить даты из файла."""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = 'Loads a JSON Lines file produced by exportdata'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='JSON Lines file, optionally gzipped')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows inserted per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+        # Соответствие id в файле и в этой базе.
+        self.ids = {'tag': {}, 'ingredient': {}, 'user': {}, 'recipe': {}}
+        self.new_recipes = set()
+        self.feed_authors = set()
+        self.counts = {}
+        loaders = {
+            'tag': self.load_tags,
+            'ingredient': self.load_ingredients,
+            'user': self.load_users,
+            'recipe': self.load_recipes,
+            'recipe_tag': self.load_recipe_tags,
+            'amount': self.load_amounts,
+            'favorite': self.load_favorites,
+            'shopping_list': self.load_shopping_lists,
+            'subscription': self.load_subscriptions,
+        }
+        path = options['path']
+        try:
+            with self.open(path) as file, preserved_dates(
+                    Recipe._meta.get_field('pub_date'),
+                    Favorite._meta.get_field('created'),
+                    ShoppingList._meta.get_field('created')):
+                for model, rows in groupby(
+                        self.read(file), key=itemgetter('model')):
+                    if model not in loaders:
+                        raise CommandError(f'Unknown model: {model}')
+                    while True:
+                        batch = list(islice(rows, batch_size))
+                        if not batch:
+                            break
+                        with transaction.atomic():
+                            loaded = loaders[model](batch)
+                        inserted, total = self.counts.get(model, (0, 0))
+                        self.counts[model] = (
+                            inserted + loaded, total + len(batch))
+        except OSError as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+        # Ленты заполняются после пересчета счетчиков: по числу
+        # подписчиков определяются авторы, рецепты которых не
+        # раскладываются.
+        call_command('reconcile_counters', verbosity=0, stdout=self.stdout)
+        self.fill_timelines(batch_size)
+        call_command('rebuild_cart_totals', stdout=self.stdout)
+        for model in (Tag, Ingredient, User, Recipe, Recipe.tags.through,
+                      AmountOfIngredients, Favorite, ShoppingList,
+                      Subscription):
+            bump_table_version(model._meta.db_table)
+        # Копии фотографий готовятся после загрузки, а не в фоновых
+        # потоках, чтобы не конкурировать с ней за запись в базу.
+        try:
+            call_command('build_image_variants', stdout=self.stdout,
+                         stderr=self.stderr)
+        except CommandError as error:
+            self.stderr.write(str(error))
+        self.stdout.write(self.style.SUCCESS(
+            'Imported ' + ', '.join(
+                f'{model}: {inserted} of {total}'
+                for model, (inserted, total) in self.counts.items())))
+
+    def open(self, path):
+        with open(path, 'rb') as file:
+            compressed = file.read(2) == GZIP_MAGIC
+        if compressed:
+            return gzip.open(path, 'rt', encoding='utf8')
+        return open(path, encoding='utf8')
+
+    def read(self, file):
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise CommandError(f'Line {number} is not valid JSON')
+            if not isinstance(row, dict) or 'model' not in row:
+                raise CommandError(f'Line {number} has no model name')
+            yield row
+
+    def create_missing(self, model, objects, key):
+        """Добавляет объекты, которых еще нет в базе (сравнение по полям
+        key), и возвращает их число: bulk_create с ignore_conflicts этого
+        не сообщает."""
+        existing = set(model.objects.filter(**{
+            f'{field}__in': {getattr(obj, field) for obj in objects}
+            for field in key}).values_list(*key))
+        objects = [
+            obj for obj in objects
+            if tuple(getattr(obj, field) for field in key) not in existing]
+        model.objects.bulk_create(objects, ignore_conflicts=True)
+        return len(objects)
+
+    def load_tags(self, rows):
+        loaded = self.create_missing(Tag, [
+            Tag(name=row['name'], color=row['color'], slug=row['slug'])
+            for row in rows], ('slug',))
+        tag_ids = dict(Tag.objects.filter(
+            slug__in=[row['slug'] for row in rows]).values_list('slug', 'id'))
+        for row in rows:
+            if row['slug'] in tag_ids:
+                self.ids['tag'][row['id']] = tag_ids[row['slug']]
+        return loaded
+
+    def load_ingredients(self, rows):
+        loaded = self.create_missing(Ingredient, [
+            Ingredient(name=row['name'],
+                       measurement_unit=row['measurement_unit'])
+            for row in rows], ('name', 'measurement_unit'))
+        ingredient_ids = {
+            (name, unit): pk
+            for pk, name, unit in Ingredient.objects.filter(
+                name__in=[row['name'] for row in rows]).values_list(
+                    'id', 'name', 'measurement_unit')}
+        for row in rows:
+            key = (row['name'], row['measurement_unit'])
+            if key in ingredient_ids:
+                self.ids['ingredient'][row['id']] = ingredient_ids[key]
+        return loaded
+
+    def load_users(self, rows):
+        fields = [field for field in USER_FIELDS if field != 'id']
+        loaded = self.create_missing(User, [
+            User(**{field: row[field] for field in fields})
+            for row in rows], ('username',))
+        user_ids = dict(User.objects.filter(
+            username__in=[row['username'] for row in rows]).values_list(
+                'username', 'id'))
+        for row in rows:
+            if row['username'] in user_ids:
+                self.ids['user'][row['id']] = user_ids[row['username']]
+        return loaded
+
+    def get_recipe_ids(self, rows):
+        return {
+            (author, name): pk
+            for pk, author, name in Recipe.objects.filter(
+                author__in={row['author'] for row in rows},
+                name__in={row['name'] for row in rows}).values_list(
+                    'id', 'author', 'name')}
+
+    def load_recipes(self, rows):
+        rows = [
+            {**row, 'author': self.ids['user'][row['author']]}
+            for row in rows if row['author'] in self.ids['user']]
+        existing = self.get_recipe_ids(rows)
+        new_rows = [
+            row for row in rows
+            if (row['author'], row['name']) not in existing]
+        recipes = [
+            Recipe(author_id=row['author'], name=row['name'],
+                   text=row['text'], cooking_time=row['cooking_time'],
+                   pub_date=row['pub_date'], image=self.save_image(row))
+            for row in new_rows]
+        Recipe.objects.bulk_create(recipes, ignore_conflicts=True)
+        recipe_ids = self.get_recipe_ids(rows)
+        for row in rows:
+            key = (row['author'], row['name'])
+            if key in recipe_ids:
+                self.ids['recipe'][row['id']] = recipe_ids[key]
+        created = [
+            (recipe_ids[(recipe.author_id, recipe.name)], recipe)
+            for recipe in recipes
+            if (recipe.author_id, recipe.name) in recipe_ids]
+        for pk, recipe in created:
+            self.new_recipes.add(pk)
+            self.feed_authors.add(recipe.author_id)
+        update_search_index(Recipe.objects.filter(
+            pk__in=[pk for pk, _ in created]))
+        return len(created)
+
+    def save_image(self, row):
+        if not row.get('image') or not row.get('image_data'):
+            return None
+        try:
+            content = base64.b64decode(row['image_data'], validate=True)
+        except binascii.Error:
+            self.stderr.write(f'Image of recipe {row["id"]} is corrupted')
+            return None
+        return default_storage.save(
+            'recipes/' + os.path.basename(row['image']),
+            ContentFile(content))
+
+    def get_new_recipe_id(self, row):
+        """id рецепта в этой базе, если рецепт добавлен этой загрузкой."""
+        recipe_id = self.ids['recipe'].get(row['recipe'])
+        return recipe_id if recipe_id in self.new_recipes else None
+
+    def load_recipe_tags(self, rows):
+        through = Recipe.tags.through
+        links = [
+            through(recipe_id=self.get_new_recipe_id(row),
+                    tag_id=self.ids['tag'][row['tag']])
+            for row in rows
+            if self.get_new_recipe_id(row) and row['tag'] in self.ids['tag']]
+        return self.create_missing(through, links, ('recipe_id', 'tag_id'))
+
+    def load_amounts(self, rows):
+        amounts = [
+            AmountOfIngredients(
+                recipe_id=self.get_new_recipe_id(row),
+                ingredient_id=self.ids['ingredient'][row['ingredient']],
+                amount=row['amount'])
+            for row in rows
+            if self.get_new_recipe_id(row)
+            and row['ingredient'] in self.ids['ingredient']]
+        return self.create_missing(
+            AmountOfIngredients, amounts, ('recipe_id', 'ingredient_id'))
+
+    def load_user_recipes(self, model, rows):
+        objects = [
+            model(user_id=self.ids['user'][row['user']],
+                  recipe_id=self.ids['recipe'][row['recipe']],
+                  created=row['created'])
+            for row in rows
+            if row['user'] in self.ids['user']
+            and row['recipe'] in self.ids['recipe']]
+        return self.create_missing(model, objects, ('user_id', 'recipe_id'))
+
+    def load_favorites(self, rows):
+        return self.load_user_recipes(Favorite, rows)
+
+    def load_shopping_lists(self, rows):
+        return self.load_user_recipes(ShoppingList, rows)
+
+    def load_subscriptions(self, rows):
+        subscriptions = [
+            Subscription(user_id=self.ids['user'][row['user']],
+                         author_id=self.ids['user'][row['author']])
+            for row in rows
+            if row['user'] in self.ids['user']
+            and row['author'] in self.ids['user']
+            and row['user'] != row['author']]
+        self.feed_authors.update(
+            subscription.author_id for subscription in subscriptions)
+        return self.create_missing(
+            Subscription, subscriptions, ('user_id', 'author_id'))
+
+    def fill_timelines(self, batch_size):
+        """Добавляет новые рецепты и подписки в ленты подписчиков: сигналы
+        при bulk_create не срабатывают. Пары (подписчик, рецепт) для
+        порции авторов выбираются одним запросом."""
+        authors = iter(sorted(self.feed_authors))
+        while True:
+            chunk = list(islice(authors, batch_size))
+            if not chunk:
+                break
+            rows = Subscription.objects.filter(
+                author__in=chunk, author__recipes__isnull=False).exclude(
+                    author__in=TimelineEntry.objects.get_celebrities(
+                        chunk)).values_list(
+                            'user_id', 'author__recipes__id').order_by()
+            with transaction.atomic():
+                rows = rows.iterator()
+                while True:
+                    batch = list(islice(rows, batch_size))
+                    if not batch:
+                        break
+                    TimelineEntry.objects.bulk_create(
+                        (TimelineEntry(user_id=user_id, recipe_id=recipe_id)
+                         for user_id, recipe_id in batch),
+                        ignore_conflicts=True)
@@ -0,0 +1,84 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingCartTotal, ShoppingList
+
+'''Пересчет и проверка итогов списков покупок (ShoppingCartTotal)'''
+'''Запуск: "python manage.py rebuild_cart_totals [--verify]"'''
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds or verifies materialized shopping cart totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Number of users processed per transaction')
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only compare stored totals with the source tables')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+        mismatches = 0
+        for user_ids in self.get_user_chunks(chunk_size):
+            if options['verify']:
+                mismatches += self.verify_chunk(user_ids)
+            else:
+                self.rebuild_chunk(user_ids)
+        if options['verify']:
+            if mismatches:
+                raise CommandError(
+                    f'{mismatches} shopping cart totals are out of sync')
+            self.stdout.write(self.style.SUCCESS(
+                'Shopping cart totals are in sync'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            'Shopping cart totals have been rebuilt'))
+
+    def get_user_chunks(self, chunk_size):
+        """Пользователи со списками покупок или сохраненными итогами,
+        порциями по chunk_size в порядке id."""
+        user_ids = sorted(
+            set(ShoppingList.objects.values_list('user_id', flat=True))
+            | set(ShoppingCartTotal.objects.values_list(
+                'user_id', flat=True)))
+        for start in range(0, len(user_ids), chunk_size):
+            yield user_ids[start:start + chunk_size]
+
+    def get_stored(self, user_ids):
+        return {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount
+            in ShoppingCartTotal.objects.filter(
+                user_id__in=user_ids).values_list(
+                    'user_id', 'ingredient_id', 'total_amount')}
+
+    def rebuild_chunk(self, user_ids):
+        with transaction.atomic():
+            # Без блокировки изменение списка покупок между расчетом и
+            # вставкой потерялось бы или было бы учтено дважды.
+            ShoppingCartTotal.objects.lock_users(user_ids)
+            expected = ShoppingCartTotal.objects.calculate(user_ids)
+            ShoppingCartTotal.objects.filter(user_id__in=user_ids).delete()
+            ShoppingCartTotal.objects.bulk_create(
+                ShoppingCartTotal(user_id=user_id,
+                                  ingredient_id=ingredient_id,
+                                  total_amount=total_amount)
+                for (user_id, ingredient_id), total_amount
+                in expected.items())
+
+    def verify_chunk(self, user_ids):
+        expected = ShoppingCartTotal.objects.calculate(user_ids)
+        stored = self.get_stored(user_ids)
+        mismatches = 0
+        for key in expected.keys() | stored.keys():
+            if expected.get(key) != stored.get(key):
+                mismatches += 1
+                user_id, ingredient_id = key
+                self.stdout.write(
+                    f'user={user_id} ingredient={ingredient_id}: '
+                    f'stored {stored.get(key)}, expected {expected.get(key)}')
+        return mismatches
@@ -0,0 +1,64 @@
+from itertools import islice
+
+from django.core.management import BaseCommand, CommandError
+
+from recipes.counters import COUNTERS, get_actual_count
+
+'''Проверка и исправление счетчиков избранного, списков покупок,
+рецептов и подписчиков'''
+'''Запуск: "python manage.py reconcile_counters [--verify]"'''
+
+
+class Command(BaseCommand):
+    help = 'Recalculates denormalized counters that drifted from the data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Number of rows checked per query')
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only report drifted counters')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        self.verbosity = options['verbosity']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+        drifted = 0
+        for model, field, related_model, related_field in COUNTERS:
+            actual = get_actual_count(related_model, related_field)
+            pks = model.objects.order_by('pk').values_list(
+                'pk', flat=True).iterator()
+            while True:
+                chunk = list(islice(pks, chunk_size))
+                if not chunk:
+                    break
+                mismatched = self.get_mismatched(
+                    model, field, actual, chunk)
+                drifted += len(mismatched)
+                if mismatched and not options['verify']:
+                    # Пересчет в самом UPDATE не теряет изменения,
+                    # сделанные после проверки.
+                    model.objects.filter(pk__in=mismatched).update(
+                        **{field: actual})
+        if options['verify']:
+            if drifted:
+                raise CommandError(f'{drifted} counters are out of sync')
+            self.stdout.write(self.style.SUCCESS('Counters are in sync'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Counters have been reconciled, fixed: {drifted}'))
+
+    def get_mismatched(self, model, field, actual, pks):
+        rows = model.objects.filter(pk__in=pks).annotate(
+            actual=actual).values_list('pk', field, 'actual')
+        mismatched = []
+        for pk, stored, expected in rows:
+            if stored != expected:
+                mismatched.append(pk)
+                if self.verbosity:
+                    self.stdout.write(
+                        f'{model._meta.model_name}={pk} {field}: '
+                        f'stored {stored}, expected {expected}')
+        return mismatched
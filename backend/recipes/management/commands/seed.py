@@ -0,0 +1,288 @@
+import random
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import transaction
+from django.utils import timezone
+
+from api.caching import bump_table_version
+from recipes.models import (AmountOfIngredients, Favorite, Ingredient,
+                            Recipe, ShoppingList, Tag, TimelineEntry)
+from recipes.search import update_search_index
+from users.models import Subscription, User
+
+from .importdata import preserved_dates
+
+'''Заполнение базы синтетическими пользователями, рецептами, избранным,
+списками покупок и подписками для нагрузочных проверок'''
+'''Запуск: "python manage.py seed [--users 200] [--recipes 1000] [--clear]"'''
+'''Данные строятся генератором с фиксированным зерном (--seed), поэтому
+одинаковые параметры дают одинаковую базу. Популярность авторов и рецептов
+распределена по закону Ципфа: у немногих рецептов много добавлений в
+избранное, у большинства - единицы.'''
+
+PREFIX = 'seed'
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+    ('Десерт', '#F2C94C', 'dessert'),
+    ('Выпечка', '#B5651D', 'bakery'),
+    ('Салаты', '#2D9CDB', 'salads'),
+    ('Супы', '#EB5757', 'soups'),
+    ('Напитки', '#56CCF2', 'drinks'),
+)
+FIRST_NAMES = ('Анна', 'Мария', 'Елена', 'Ольга', 'Дарья', 'Иван',
+               'Алексей', 'Дмитрий', 'Сергей', 'Михаил', 'Павел', 'Ирина')
+LAST_NAMES = ('Иванова', 'Смирнова', 'Кузнецова', 'Попова', 'Соколова',
+              'Лебедева', 'Козлова', 'Новикова', 'Морозова', 'Волкова')
+DISH_ADJECTIVES = ('Домашний', 'Быстрый', 'Пряный', 'Летний', 'Зимний',
+                   'Бабушкин', 'Легкий', 'Сытный', 'Праздничный', 'Острый')
+DISHES = ('пирог', 'суп', 'салат', 'омлет', 'плов', 'рулет', 'гуляш',
+          'морс', 'кекс', 'рагу', 'борщ', 'соус', 'пудинг', 'шашлык')
+STEPS = ('Нарезать все ингредиенты небольшими кусочками.',
+         'Разогреть сковороду и обжарить до золотистого цвета.',
+         'Посолить, поперчить и перемешать.',
+         'Тушить под крышкой на медленном огне.',
+         'Выпекать в разогретой духовке до готовности.',
+         'Охладить и подать к столу.',
+         'Украсить зеленью перед подачей.')
+
+
+class Command(BaseCommand):
+    help = 'Generates reproducible synthetic data for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=200,
+            help='Number of users to create')
+        parser.add_argument(
+            '--authors', type=float, default=0.3,
+            help='Share of users that publish recipes')
+        parser.add_argument(
+            '--recipes', type=int, default=1000,
+            help='Number of recipes to create')
+        parser.add_argument(
+            '--ingredients', type=int, nargs=2, default=(3, 12),
+            metavar=('MIN', 'MAX'),
+            help='Range of ingredients per recipe')
+        parser.add_argument(
+            '--favorites', type=int, default=30,
+            help='Maximum number of favorites per user')
+        parser.add_argument(
+            '--carts', type=int, default=8,
+            help='Maximum number of shopping cart recipes per user')
+        parser.add_argument(
+            '--subscriptions', type=int, default=15,
+            help='Maximum number of subscriptions per user')
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='Spread publication dates over this many last days')
+        parser.add_argument(
+            '--seed', type=int, default=42,
+            help='Random seed; the same seed gives the same data')
+        parser.add_argument(
+            '--password', default='Seed-Pa55word',
+            help='Password of every generated user')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows inserted per query')
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete previously generated users and their data first')
+
+    def handle(self, *args, **options):
+        self.validate(options)
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        seeded_users = User.objects.filter(username__startswith=f'{PREFIX}-')
+        if seeded_users.exists():
+            if not options['clear']:
+                raise CommandError(
+                    'Generated data already exists, use --clear to replace')
+            seeded_users.delete()
+        if not Ingredient.objects.exists():
+            call_command('dbloader', stdout=self.stdout)
+        with preserved_dates(
+                Recipe._meta.get_field('pub_date'),
+                Favorite._meta.get_field('created'),
+                ShoppingList._meta.get_field('created')):
+            with transaction.atomic():
+                tag_ids = self.create_tags()
+                user_ids = self.create_users(
+                    options['users'], options['password'])
+            authors = user_ids[:max(1, round(
+                len(user_ids) * options['authors']))]
+            with transaction.atomic():
+                recipe_ids = self.create_recipes(
+                    authors, options['recipes'], options['days'])
+            with transaction.atomic():
+                self.create_recipe_tags(recipe_ids, tag_ids)
+                self.create_amounts(recipe_ids, *options['ingredients'])
+            with transaction.atomic():
+                self.create_user_recipes(
+                    Favorite, user_ids, recipe_ids, options['favorites'])
+                self.create_user_recipes(
+                    ShoppingList, user_ids, recipe_ids, options['carts'])
+                self.create_subscriptions(
+                    user_ids, authors, options['subscriptions'])
+        self.finish(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(user_ids)} users and {len(recipe_ids)} recipes '
+            f'with seed {options["seed"]}'))
+
+    def validate(self, options):
+        for option in ('users', 'recipes', 'batch_size', 'days'):
+            if options[option] < 1:
+                raise CommandError(
+                    f'--{option.replace("_", "-")} must be positive')
+        for option in ('favorites', 'carts', 'subscriptions'):
+            if options[option] < 0:
+                raise CommandError(f'--{option} must not be negative')
+        if not 0 < options['authors'] <= 1:
+            raise CommandError('--authors must be in (0, 1]')
+        low, high = options['ingredients']
+        if not 1 <= low <= high:
+            raise CommandError('--ingredients must be 1 <= MIN <= MAX')
+
+    def zipf_weights(self, count):
+        """Накопленные веса 1, 1/2, 1/3, ... для random.choices."""
+        return list(accumulate(1 / rank for rank in range(1, count + 1)))
+
+    def sample(self, population, cum_weights, count):
+        """До count различных элементов с вероятностями по весам.
+        Повторные выпадения отбрасываются, поэтому для популярных
+        элементов результат может оказаться короче count."""
+        if not count:
+            return []
+        draws = self.random.choices(
+            population, cum_weights=cum_weights, k=count * 2)
+        return list(dict.fromkeys(draws))[:count]
+
+    def bulk_create(self, model, objects):
+        objects = iter(objects)
+        while True:
+            batch = list(islice(objects, self.batch_size))
+            if not batch:
+                break
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+
+    def create_tags(self):
+        self.bulk_create(Tag, (
+            Tag(name=name, color=color, slug=slug)
+            for name, color, slug in TAGS))
+        return list(Tag.objects.filter(
+            slug__in=[slug for _, _, slug in TAGS]).values_list(
+                'id', flat=True))
+
+    def create_users(self, count, password):
+        # Хеш пароля считается один раз: make_password намеренно медленный.
+        password = make_password(password)
+        now = timezone.now()
+        self.bulk_create(User, (
+            User(username=f'{PREFIX}-{i}', email=f'{PREFIX}-{i}@example.com',
+                 first_name=self.random.choice(FIRST_NAMES),
+                 last_name=self.random.choice(LAST_NAMES),
+                 password=password, date_joined=now)
+            for i in range(count)))
+        user_ids = list(User.objects.filter(
+            username__startswith=f'{PREFIX}-').order_by('id').values_list(
+                'id', flat=True))
+        self.random.shuffle(user_ids)
+        return user_ids
+
+    def create_recipes(self, authors, count, days):
+        now = timezone.now()
+        names = set()
+        recipes = []
+        weights = self.zipf_weights(len(authors))
+        for author in self.random.choices(
+                authors, cum_weights=weights, k=count):
+            name = (f'{self.random.choice(DISH_ADJECTIVES)} '
+                    f'{self.random.choice(DISHES)}')
+            number = 1
+            while (author, name) in names:
+                number += 1
+                name = f'{name.rsplit(" №", 1)[0]} №{number}'
+            names.add((author, name))
+            recipes.append(Recipe(
+                author_id=author, name=name,
+                text=' '.join(self.random.sample(
+                    STEPS, self.random.randint(2, len(STEPS)))),
+                cooking_time=self.random.randint(5, 180),
+                pub_date=now - timedelta(
+                    seconds=self.random.randint(0, days * 24 * 3600))))
+        self.bulk_create(Recipe, recipes)
+        # bulk_create в SQLite не возвращает id, поэтому они читаются
+        # заново; сортировка по дате делает порядок воспроизводимым.
+        return list(Recipe.objects.filter(
+            author__in=authors).order_by('pub_date', 'id').values_list(
+                'id', flat=True))
+
+    def create_recipe_tags(self, recipe_ids, tag_ids):
+        through = Recipe.tags.through
+        self.bulk_create(through, (
+            through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.random.sample(
+                tag_ids, self.random.randint(1, min(3, len(tag_ids))))))
+
+    def create_amounts(self, recipe_ids, low, high):
+        ingredient_ids = list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True))
+        self.bulk_create(AmountOfIngredients, (
+            AmountOfIngredients(
+                recipe_id=recipe_id, ingredient_id=ingredient_id,
+                amount=self.random.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in self.random.sample(
+                ingredient_ids,
+                min(len(ingredient_ids), self.random.randint(low, high)))))
+
+    def create_user_recipes(self, model, user_ids, recipe_ids, maximum):
+        if not maximum:
+            return
+        # Популярность не зависит от даты публикации.
+        popular = self.random.sample(recipe_ids, len(recipe_ids))
+        weights = self.zipf_weights(len(popular))
+        now = timezone.now()
+        self.bulk_create(model, (
+            model(user_id=user_id, recipe_id=recipe_id,
+                  created=now - timedelta(
+                      seconds=self.random.randint(0, 30 * 24 * 3600)))
+            for user_id in user_ids
+            for recipe_id in self.sample(
+                popular, weights, self.random.randint(0, maximum))))
+
+    def create_subscriptions(self, user_ids, authors, maximum):
+        weights = self.zipf_weights(len(authors))
+        self.bulk_create(Subscription, (
+            Subscription(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in self.sample(
+                authors, weights, self.random.randint(0, maximum))
+            if author_id != user_id))
+
+    def finish(self, user_ids):
+        """Обновляет то, что при bulk_create поддерживают сигналы."""
+        recipes = Recipe.objects.filter(author__in=user_ids)
+        # Авторы, чьи рецепты не раскладываются по лентам, определяются по
+        # счетчику подписчиков, поэтому счетчики пересчитываются первыми.
+        call_command('reconcile_counters', verbosity=0, stdout=self.stdout)
+        with transaction.atomic():
+            update_search_index(recipes)
+            rows = Subscription.objects.filter(
+                user__in=user_ids, author__recipes__isnull=False).exclude(
+                    author__in=TimelineEntry.objects.get_celebrities(
+                        user_ids)).values_list(
+                            'user_id', 'author__recipes__id').order_by()
+            self.bulk_create(TimelineEntry, (
+                TimelineEntry(user_id=user_id, recipe_id=recipe_id)
+                for user_id, recipe_id in rows.iterator()))
+        call_command('rebuild_cart_totals', stdout=self.stdout)
+        for model in (Tag, User, Recipe, Recipe.tags.through,
+                      AmountOfIngredients, Favorite, ShoppingList,
+                      Subscription):
+            bump_table_version(model._meta.db_table)
@@ -0,0 +1,65 @@
+# Generated by Django 3.2.3 on 2026-10-18 04:29
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_created(apps, schema_editor):
+    """Существующим строкам проставляется дата публикации рецепта, а не
+    время миграции: иначе все старые добавления попали бы в окно расчета
+    популярности как свежие."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    pub_date = Subquery(Recipe.objects.filter(
+        pk=OuterRef('recipe_id')).values('pub_date'))
+    for model_name in ('Favorite', 'ShoppingList'):
+        apps.get_model('recipes', model_name).objects.update(
+            created=pub_date)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('score', models.FloatField(verbose_name='Популярность')),
+                ('computed_at', models.DateTimeField(verbose_name='Дата расчета')),
+            ],
+            options={
+                'verbose_name': 'Популярность рецепта',
+                'verbose_name_plural': 'Популярность рецептов',
+                'ordering': ('-score', '-recipe_id'),
+            },
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(db_index=True, null=True, verbose_name='Дата добавления'),
+        ),
+        migrations.AddField(
+            model_name='shoppinglist',
+            name='created',
+            field=models.DateTimeField(db_index=True, null=True, verbose_name='Дата добавления'),
+        ),
+        migrations.RunPython(fill_created, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата добавления'),
+        ),
+        migrations.AlterField(
+            model_name='shoppinglist',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата добавления'),
+        ),
+        migrations.AddIndex(
+            model_name='recipescore',
+            index=models.Index(fields=['-score', '-recipe'], name='recipe_score_idx'),
+        ),
+    ]
@@ -1,7 +1,14 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import RowNumber
 
-from users.models import User
+from users.models import CounterFieldsMixin, Subscription, User
 
 
 MIN_UNIT_AMOUNT: int = 1
@@ -60,7 +67,91 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def with_relations(self, fields=None):
+        """Подгружает автора, теги и ингредиенты за фиксированное
+        число запросов, независимо от количества рецептов.
+
+        fields - имена полей ответа; связи, не попавшие в него,
+        не загружаются, а поле text не выбирается из базы.
+        """
+        queryset = self
+        if fields is None or 'author' in fields:
+            queryset = queryset.select_related('author')
+        if fields is None or 'tags' in fields:
+            queryset = queryset.prefetch_related(
+                models.Prefetch('tags', queryset=Tag.objects.all()))
+        if fields is None or 'ingredients' in fields:
+            queryset = queryset.prefetch_related(models.Prefetch(
+                'recipes',
+                queryset=AmountOfIngredients.objects.select_related(
+                    'ingredient')))
+        if fields is not None and 'text' not in fields:
+            queryset = queryset.defer('text')
+        return queryset
+
+    def with_user_flags(self, user, fields=None):
+        """Добавляет is_favorited и is_in_shopping_cart для пользователя."""
+        if user.is_anonymous:
+            return self
+        flags = {
+            'is_favorited': models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            'is_in_shopping_cart': models.Exists(ShoppingList.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+        }
+        return self.annotate(**{
+            name: flag for name, flag in flags.items()
+            if fields is None or name in fields})
+
+    def feed(self, user):
+        """Рецепты авторов, на которых подписан user: из его ленты и,
+        для авторов с числом подписчиков больше FEED_FANOUT_MAX_FOLLOWERS,
+        напрямую из таблицы рецептов."""
+        celebrities = TimelineEntry.objects.get_celebrities(
+            Subscription.objects.filter(user=user).values('author_id'))
+        return self.filter(
+            models.Q(pk__in=TimelineEntry.objects.filter(
+                user=user).values('recipe'))
+            | models.Q(author__in=celebrities))
+
+    def latest_by_author(self, authors, limit=None):
+        """Возвращает словарь {id автора: список рецептов}.
+
+        Рецепты всех авторов выбираются одним запросом; при заданном limit
+        для каждого автора остаются только limit последних рецептов
+        (ROW_NUMBER() OVER (PARTITION BY author_id ORDER BY pub_date DESC)).
+        """
+        queryset = self.filter(author__in=authors).order_by(
+            'author_id', '-pub_date', '-id')
+        if limit is not None:
+            ranked = queryset.annotate(recipe_rank=models.Window(
+                expression=RowNumber(),
+                partition_by=models.F('author_id'),
+                order_by=(models.F('pub_date').desc(),
+                          models.F('id').desc()),
+            )).order_by()
+            sql, params = ranked.query.sql_with_params()
+            queryset = self.raw(
+                f'SELECT * FROM ({sql}) ranked '
+                f'WHERE ranked.recipe_rank <= %s '
+                f'ORDER BY ranked.author_id, ranked.recipe_rank',
+                (*params, limit))
+        recipes = defaultdict(list)
+        for recipe in queryset:
+            recipes[recipe.author_id].append(recipe)
+        return recipes
+
+
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+
+    def get_queryset(self):
+        # Поисковый вектор нужен только в условиях поиска.
+        return super().get_queryset().defer('search_vector')
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     author = models.ForeignKey(
         User, verbose_name='Автор рецепта',
         on_delete=models.CASCADE,
@@ -76,6 +167,11 @@ class Recipe(models.Model):
         null=True,
         default=None
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии изображения',
+        default=dict,
+        blank=True
+    )
     text = models.TextField(
         verbose_name='Описание рецепта'
     )
@@ -105,11 +201,36 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False
+    )
+
+    counter_fields = ('favorites_count', 'in_carts_count')
+
+    objects = RecipeManager()
 
     class Meta:
-        ordering = ('-pub_date',)
+        ordering = ('-pub_date', '-id')
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['author', 'name'],
@@ -152,6 +273,10 @@ class AmountOfIngredients(models.Model):
         ordering = ('ingredient',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Количество ингридиентов'
+        indexes = [
+            models.Index(fields=['ingredient', 'recipe'],
+                         name='amount_ingredient_recipe_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['recipe', 'ingredient'],
@@ -176,6 +301,11 @@ class ShoppingList(models.Model):
         on_delete=models.CASCADE,
         related_name='shoppinglist'
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
 
     class Meta:
         ordering = ('recipe',)
@@ -204,6 +334,11 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         related_name='favorites'
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        db_index=True
+    )
 
     class Meta:
         ordering = ('recipe',)
@@ -217,3 +352,261 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f'{self.user}, {self.recipe}'
+
+
+class ShoppingCartTotalManager(models.Manager):
+
+    def get_amounts(self, recipe):
+        """Возвращает {id ингредиента: количество} для рецепта."""
+        return dict(AmountOfIngredients.objects.filter(
+            recipe=recipe).values_list('ingredient_id', 'amount'))
+
+    def lock_users(self, user_ids):
+        """Блокирует пользователей user_ids до конца транзакции (в порядке
+        id, чтобы избежать взаимных блокировок)."""
+        list(User.objects.select_for_update().filter(
+            pk__in=user_ids).order_by('pk').values_list('pk'))
+
+    def apply_deltas(self, user_ids, deltas):
+        """Прибавляет deltas {id ингредиента: изменение} к итогам
+        списков покупок пользователей user_ids."""
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta}
+        user_ids = sorted(set(user_ids))
+        if not deltas or not user_ids:
+            return
+        with transaction.atomic():
+            # Строк итогов для новых ингредиентов еще нет, и
+            # select_for_update их не блокирует; блокировка пользователей
+            # не дает параллельным изменениям вставить одну строку дважды.
+            self.lock_users(user_ids)
+            totals = self.select_for_update().filter(
+                user_id__in=user_ids, ingredient_id__in=deltas)
+            existing = set()
+            to_update = []
+            to_delete = []
+            for total in totals:
+                existing.add((total.user_id, total.ingredient_id))
+                total.total_amount += deltas[total.ingredient_id]
+                if total.total_amount > 0:
+                    to_update.append(total)
+                else:
+                    to_delete.append(total.pk)
+            self.bulk_update(to_update, ('total_amount',))
+            self.filter(pk__in=to_delete).delete()
+            self.bulk_create(
+                self.model(user_id=user_id, ingredient_id=ingredient_id,
+                           total_amount=delta)
+                for user_id in user_ids
+                for ingredient_id, delta in deltas.items()
+                if delta > 0 and (user_id, ingredient_id) not in existing)
+
+    def get_total_amounts(self, recipe_ids):
+        """Возвращает {id ингредиента: количество} для суммы рецептов."""
+        return dict(AmountOfIngredients.objects.filter(
+            recipe_id__in=recipe_ids).values_list('ingredient_id').annotate(
+                total_amount=models.Sum('amount')).order_by())
+
+    def add_recipe(self, user_id, recipe_id):
+        self.apply_deltas((user_id,), self.get_amounts(recipe_id))
+
+    def add_recipes(self, user, recipe_ids):
+        self.apply_deltas((user.pk,), self.get_total_amounts(recipe_ids))
+
+    def remove_recipes(self, user, recipe_ids):
+        self.apply_deltas((user.pk,), {
+            ingredient_id: -amount
+            for ingredient_id, amount
+            in self.get_total_amounts(recipe_ids).items()})
+
+    def remove_recipe(self, user_id, recipe_id):
+        self.apply_deltas((user_id,), {
+            ingredient_id: -amount
+            for ingredient_id, amount in self.get_amounts(recipe_id).items()})
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Переносит изменение состава рецепта в списки покупок,
+        в которых он лежит."""
+        deltas = {
+            ingredient_id: (new_amounts.get(ingredient_id, 0)
+                            - old_amounts.get(ingredient_id, 0))
+            for ingredient_id in old_amounts.keys() | new_amounts.keys()}
+        if not any(deltas.values()):
+            return
+        self.apply_deltas(
+            ShoppingList.objects.filter(recipe=recipe).values_list(
+                'user_id', flat=True),
+            deltas)
+
+    @contextmanager
+    def tracking(self, recipe_ids):
+        """Переносит в списки покупок изменения состава рецептов
+        recipe_ids, сделанные внутри блока with."""
+        old_amounts = {
+            recipe_id: self.get_amounts(recipe_id)
+            for recipe_id in recipe_ids}
+        yield
+        for recipe_id, amounts in old_amounts.items():
+            self.change_recipe(
+                recipe_id, amounts, self.get_amounts(recipe_id))
+
+    def calculate(self, user_ids):
+        """Считает итоги по таблицам рецептов:
+        {(id пользователя, id ингредиента): количество}."""
+        rows = AmountOfIngredients.objects.filter(
+            recipe__shoppinglist__user_id__in=user_ids).values_list(
+                'recipe__shoppinglist__user_id', 'ingredient_id').annotate(
+                    total_amount=models.Sum('amount')).order_by()
+        return {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in rows}
+
+
+class ShoppingCartTotal(models.Model):
+    """Материализованные суммы ингредиентов в списке покупок."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_totals'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_totals'
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Общее количество'
+    )
+
+    objects = ShoppingCartTotalManager()
+
+    class Meta:
+        ordering = ('user', 'ingredient')
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_total'),
+        ]
+
+    def __str__(self):
+        return f'{self.user}, {self.ingredient}, {self.total_amount}'
+
+
+class TimelineEntryManager(models.Manager):
+    """Ленты подписок с раскладкой рецептов при публикации (fan-out on
+    write). Рецепты авторов, у которых подписчиков больше
+    FEED_FANOUT_MAX_FOLLOWERS, не раскладываются, а выбираются при
+    чтении ленты (см. RecipeQuerySet.feed)."""
+
+    def get_max_followers(self):
+        return getattr(settings, 'FEED_FANOUT_MAX_FOLLOWERS', 10000)
+
+    def is_celebrity(self, author_id):
+        return self.get_celebrities((author_id,)).exists()
+
+    def get_celebrities(self, authors):
+        """Выборка id авторов из authors, рецепты которых не
+        раскладываются по лентам. Число подписчиков берется из счетчика
+        User.followers_count, а не считается по подпискам."""
+        return User.objects.filter(
+            pk__in=authors,
+            followers_count__gt=self.get_max_followers()).values('pk')
+
+    def fan_out(self, recipe):
+        """Добавляет рецепт в ленты подписчиков автора пачками по
+        FEED_FANOUT_BATCH_SIZE строк."""
+        if self.is_celebrity(recipe.author_id):
+            return
+        batch_size = getattr(settings, 'FEED_FANOUT_BATCH_SIZE', 1000)
+        follower_ids = Subscription.objects.filter(
+            author_id=recipe.author_id).values_list(
+                'user_id', flat=True).iterator()
+        while True:
+            batch = list(islice(follower_ids, batch_size))
+            if not batch:
+                break
+            self.bulk_create(
+                (self.model(user_id=user_id, recipe_id=recipe.pk)
+                 for user_id in batch),
+                ignore_conflicts=True)
+
+    def backfill(self, user_id, author_id):
+        """Добавляет в ленту нового подписчика последние
+        FEED_BACKFILL_SIZE рецептов автора."""
+        if self.is_celebrity(author_id):
+            return
+        recipe_ids = Recipe.objects.filter(author_id=author_id).values_list(
+            'id', flat=True)[:getattr(settings, 'FEED_BACKFILL_SIZE', 100)]
+        self.bulk_create(
+            (self.model(user_id=user_id, recipe_id=recipe_id)
+             for recipe_id in recipe_ids),
+            ignore_conflicts=True)
+
+    def trim(self, user_id, author_id):
+        self.filter(user_id=user_id, recipe__author_id=author_id).delete()
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписок пользователя."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Подписчик',
+        on_delete=models.CASCADE,
+        related_name='timeline'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        related_name='timeline_entries'
+    )
+
+    objects = TimelineEntryManager()
+
+    class Meta:
+        ordering = ('user', 'recipe')
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'),
+        ]
+
+    def __str__(self):
+        return f'{self.user}, {self.recipe}'
+
+
+class RecipeScore(models.Model):
+    """Популярность рецепта по недавним добавлениям в избранное и списки
+    покупок. Пересчитывается командой compute_trending."""
+    recipe = models.OneToOneField(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score'
+    )
+    score = models.FloatField(
+        verbose_name='Популярность'
+    )
+    computed_at = models.DateTimeField(
+        verbose_name='Дата расчета'
+    )
+
+    class Meta:
+        ordering = ('-score', '-recipe_id')
+        verbose_name = 'Популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+        indexes = [
+            models.Index(fields=['-score', '-recipe'],
+                         name='recipe_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe}, {self.score:.2f}'
@@ -0,0 +1,90 @@
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.db import connection
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+'''Полнотекстовый поиск по названию и описанию рецептов.
+
+В PostgreSQL используется хранимое поле search_vector (tsvector с русской
+морфологией) и GIN-индекс, в SQLite - таблица FTS5 recipes_recipe_fts.
+'''
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+# Веса bm25 для столбцов name и text таблицы FTS5.
+FTS_WEIGHTS = (10.0, 1.0)
+# Окончания, отбрасываемые в SQLite вместо морфологии PostgreSQL.
+ENDINGS = re.compile(
+    r'(ями|ами|ого|его|ому|ему|ыми|ими|ах|ях|ов|ев|ей|ой|ый|ий|ая|яя|ое|ее'
+    r'|ую|юю|ом|ем|ы|и|а|я|о|е|у|ю|ь)$')
+
+
+def fold_yo(text):
+    """В SQLite "ё" и "е" различаются, поэтому приводятся к "е"."""
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+def get_search_vector():
+    return (SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG))
+
+
+def update_search_index(queryset):
+    """Пересчитывает поисковый индекс для рецептов выборки."""
+    if connection.vendor == 'postgresql':
+        queryset.update(search_vector=get_search_vector())
+    elif connection.vendor == 'sqlite':
+        rows = [
+            (pk, fold_yo(name), fold_yo(text))
+            for pk, name, text in queryset.values_list('id', 'name', 'text')]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(pk,) for pk, _, _ in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+                f'VALUES (%s, %s, %s)', rows)
+
+
+def remove_from_search_index(recipe_ids):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(pk,) for pk in recipe_ids])
+
+
+def get_fts_query(text):
+    """Запрос FTS5: все слова обязательны, каждое ищется по основе."""
+    terms = []
+    for word in re.findall(r'\w+', fold_yo(text.lower())):
+        stem = ENDINGS.sub('', word)
+        terms.append(f'"{stem if len(stem) >= 3 else word}"*')
+    return ' '.join(terms)
+
+
+def search(queryset, text):
+    """Оставляет рецепты, подходящие под запрос, и сортирует их по
+    релевантности (аннотация search_rank)."""
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(text, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-pub_date', '-id')
+    fts_query = get_fts_query(text)
+    if not fts_query:
+        return queryset.none()
+    table = queryset.model._meta.db_table
+    weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (fts_query,))
+    ).annotate(search_rank=RawSQL(
+        f'SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+        (fts_query,))
+    ).order_by('-search_rank', '-pub_date', '-id')
@@ -0,0 +1,126 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from users.models import Subscription
+
+from .counters import COUNTERS, change_counters, is_updated_in_bulk
+from .indexes import ingredient_index, recipe_index
+from .models import (AmountOfIngredients, Favorite, Ingredient, Recipe,
+                     ShoppingCartTotal, ShoppingList, TimelineEntry)
+from .search import remove_from_search_index, update_search_index
+
+# Поле пользователя, под блокировкой которого удаляются строки модели.
+ROW_OWNERS = {
+    Favorite: 'user',
+    ShoppingList: 'user',
+    Subscription: 'user',
+    Recipe: 'author',
+}
+
+
+def is_deleted_here(instance):
+    """Блокирует владельца строки instance и проверяет, что строку еще не
+    удалил параллельный запрос: тогда счетчики и итоги уже уменьшены им.
+    Вызывается в pre_delete; результат запоминается в объекте, потому что
+    в post_delete строки в базе уже нет."""
+    if not hasattr(instance, '_deleted_here'):
+        owner_id = getattr(instance, f'{ROW_OWNERS[type(instance)]}_id')
+        ShoppingCartTotal.objects.lock_users((owner_id,))
+        instance._deleted_here = type(instance).objects.filter(
+            pk=instance.pk).exists()
+    return instance._deleted_here
+
+
+def increment_counters(sender, instance, created, **kwargs):
+    if created and not is_updated_in_bulk():
+        change_counters(instance, 1)
+
+
+def check_counted_row(sender, instance, **kwargs):
+    if not is_updated_in_bulk():
+        is_deleted_here(instance)
+
+
+def decrement_counters(sender, instance, **kwargs):
+    if not is_updated_in_bulk() and is_deleted_here(instance):
+        change_counters(instance, -1)
+
+
+# Счетчики подключаются раньше остальных обработчиков: например,
+# заполнение ленты проверяет число подписчиков автора.
+for model in {related_model for _, _, related_model, _ in COUNTERS}:
+    post_save.connect(increment_counters, sender=model)
+    pre_delete.connect(check_counted_row, sender=model)
+    post_delete.connect(decrement_counters, sender=model)
+
+
+@receiver(post_save, sender=ShoppingList)
+def add_recipe_to_cart_totals(sender, instance, created, **kwargs):
+    if created and not is_updated_in_bulk():
+        ShoppingCartTotal.objects.add_recipe(
+            instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingList)
+def remove_recipe_from_cart_totals(sender, instance, **kwargs):
+    """Вычитает рецепт из итогов до удаления: при каскадном удалении
+    рецепта его состав к post_delete может быть уже удален.
+
+    Строка проверяется заново под блокировкой пользователя: если
+    параллельный запрос уже удалил ее, рецепт из итогов уже вычтен."""
+    if not is_updated_in_bulk() and is_deleted_here(instance):
+        ShoppingCartTotal.objects.remove_recipe(
+            instance.user_id, instance.recipe_id)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search_index(sender, instance, update_fields=None,
+                               **kwargs):
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        update_search_index(Recipe.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_search_index(sender, instance, **kwargs):
+    remove_from_search_index((instance.pk,))
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_recipe_index(sender, instance, **kwargs):
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: recipe_index.remove_recipe(recipe_id))
+
+
+@receiver(post_save, sender=AmountOfIngredients)
+@receiver(post_delete, sender=AmountOfIngredients)
+def refresh_recipe_in_recipe_index(sender, instance, **kwargs):
+    recipe_id = instance.recipe_id
+    transaction.on_commit(lambda: recipe_index.refresh_recipe(recipe_id))
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: TimelineEntry.objects.fan_out(instance))
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        user_id, author_id = instance.user_id, instance.author_id
+        transaction.on_commit(
+            lambda: TimelineEntry.objects.backfill(user_id, author_id))
+
+
+@receiver(post_delete, sender=Subscription)
+def trim_timeline(sender, instance, **kwargs):
+    user_id, author_id = instance.user_id, instance.author_id
+    transaction.on_commit(
+        lambda: TimelineEntry.objects.trim(user_id, author_id))
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.3 on 2026-10-18 04:28
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Upper
+
+
+def get_count(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(count=Count('pk')).values('count')), 0)
+
+
+def fill_user_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Subscription = apps.get_model('users', 'Subscription')
+    User.objects.update(
+        recipes_count=get_count(Recipe, 'author'),
+        followers_count=get_count(Subscription, 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_counters'),
+        ('users', '0002_user_subscription_indexes'),
+    ]
+
+    # SQLite добавляет поля, пересоздавая таблицу, и Django 3.2 не может
+    # перенести в новую таблицу индекс по выражению. Поэтому индекс
+    # удаляется на время добавления полей.
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='user_email_upper_idx',
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Рецептов'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(Upper('email'), name='user_email_upper_idx'),
+        ),
+        migrations.RunPython(
+            fill_user_counters, migrations.RunPython.noop),
+    ]
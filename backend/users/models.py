@@ -1,8 +1,29 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Upper
 
 
-class User(AbstractUser):
+class CounterFieldsMixin:
+    """Повторное сохранение загруженного объекта не записывает столбцы
+    counter_fields: их меняют только атомарные UPDATE из recipes.counters,
+    и значения в объекте к этому моменту могут устареть. Как и в обычном
+    save(), незагруженные (отложенные) поля не записываются."""
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not args
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            skipped = set(self.counter_fields) | self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in skipped
+                and field.name not in skipped]
+        super().save(*args, **kwargs)
+
+
+class User(CounterFieldsMixin, AbstractUser):
     username = models.CharField(
         'Логин',
         max_length=150,
@@ -24,6 +45,18 @@ class User(AbstractUser):
         'Фамилия',
         max_length=150,
     )
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('recipes_count', 'followers_count')
 
     class Meta:
         ordering = ('id',)
@@ -34,6 +67,11 @@ class User(AbstractUser):
                 fields=['username', 'email'],
                 name='pair username/email should be unique'),
         ]
+        indexes = [
+            models.Index(fields=['email'], name='user_email_idx'),
+            # Для поиска почты без учета регистра (email__iexact).
+            models.Index(Upper('email'), name='user_email_upper_idx'),
+        ]
 
     def __str__(self):
         return self.username
@@ -62,6 +100,10 @@ class Subscription(models.Model):
                 fields=['user', 'author'],
                 name='unique_subscriptions'),
         ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='subscription_author_user_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user}, {self.author}'